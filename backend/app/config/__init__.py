@@ -24,21 +24,56 @@ class Settings(BaseSettings):
     ALLOWED_IPS: str = "*"
     DB_URL: str
     DB_POOL_SIZE: int = 10
+    DB_REPLICA_URLS: str = ""  # comma separated, empty: everything on DB_URL
+    DB_REPLICA_POOL_SIZE: int = 10
+    DB_REPLICA_STRATEGY: str = "round_robin"  # round_robin | least_busy
+    DB_MIGRATE_ON_STARTUP: bool = True  # False: a schema mismatch fails startup, migrate with python -m utils.schema_util
     SECRET_KEY: str
     REFRESH_SECRET_KEY: str
+    HANDSHAKE_SECRET_KEY: str  # seeds the x25519 login handshake keys, independent of the jwt secrets
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
+    JWT_KEY_DIR: str = os.path.join(app_dir, "resources", os.getenv("BUILD_ENV", "local"), "jwt_keys")
+    JWT_KEY_RELOAD_SECONDS: int = 30
+    JWT_KEY_PUBLISH_SECONDS: int = 300
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7
     API_KEY: str
     HTTP_DIGEST_AUTH_PASSWORD: str
     USER_DEFAULT_AUTHORITY_CODE: int = 4
     USER_INACTIVE_AUTHORITY_CODE: int = 99
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_QUEUE_LIMIT: int = 64
+    BCRYPT_ROUNDS: int = 0  # 0: calibrate against BCRYPT_TARGET_MS once, shared by all workers (t_app_setting)
+    BCRYPT_TARGET_MS: int = 250
+    BCRYPT_MIN_ROUNDS: int = 10
+    BCRYPT_MAX_ROUNDS: int = 14
+    VERIFIED_TOKEN_CACHE_SIZE: int = 4096
+    USER_CACHE_SIZE: int = 4096
+    USER_CACHE_TTL_SECONDS: int = 300
+    HANDSHAKE_KEY_ROTATE_MINUTES: int = 60
+    HANDSHAKE_MAX_AGE_SECONDS: int = 300  # encrypted login timestamps further off than this are rejected
+    REVOKED_TOKEN_FILTER_CAPACITY: int = 100000
+    BULK_INSERT_BATCH_SIZE: int = 1000
+    USER_IMPORT_MAX_USERS: int = 200  # per import request, every new user costs one full cost bcrypt hash (~0.2s of a core)
+    STATEMENT_CACHE_SIZE: int = 512
+    DEFAULT_PAGE_SIZE: int = 50
+    MAX_PAGE_SIZE: int = 500
+    CONVERSATION_TAIL_SIZE: int = 50
+    CONVERSATION_CACHE_SIZE: int = 1024
+    CONVERSATION_CACHE_TTL_SECONDS: int = 1800
+    QUOTA_DEFAULT_TOTAL: int = 100  # total_quota of the row created on a user's first guarded request
+    QUOTA_BUCKET_SIZE: int = 0  # >1: reserve this many units per user and worker at once
+    QUOTA_FLUSH_SECONDS: int = 10
+    QUOTA_RESET_HOURS: int = 24
+    QUOTA_RESET_CHUNK_SIZE: int = 1000
+    QUOTA_SWEEP_SECONDS: int = 300
 
     # INIT_SCHEDULE_TASK: bool = False
     # CRONTAB_INTERVAL: str = "0 * * * *"
     # AWS_ACCOUNT_ID: str = "739616288903"
     # S3_BUCKET: str = "7cloud-media"
     # S3_REGION: str = "ap-northeast-1"
+    S3_VERIFY_AFTER_WRITE: bool = False  # HEAD after every put / delete and before every delete
     # USER_POOL_ID: str = ""
     # USER_POOL_REGION: str = ""
     # IDENTITY_POOL_REGION: str = ""
@@ -1,4 +1,5 @@
 import dataclasses
+from datetime import datetime
 from typing import TypedDict
 from enum import Enum
 
@@ -25,4 +26,67 @@ class UserWithToken:
     id_token: str
 
 
-CurrentUser = UserWithToken
+@dataclasses.dataclass(frozen=True, slots=True)
+class UserPrincipal:
+    id: str
+    username: str
+    authority_level: int
+    created_at: datetime | None = None
+    update_datetime: datetime | None = None
+    id_token: str = ""
+
+    @property
+    def authority_code(self) -> int:
+        return self.authority_level
+
+
+CurrentUser = UserPrincipal
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class UserProfile:
+    """read-only projection of t_user + t_user_base_info, built straight from a row tuple"""
+    id: str
+    username: str
+    authority_level: int
+    nickname: str | None
+    gender: str | None
+    phone_number: str | None
+    org_name: str | None
+    post_number: str | None
+    city_id: int | None
+    district_id: int | None
+    address: str | None
+    created_at: datetime | None
+    update_datetime: datetime | None
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class MessageRecord:
+    id: int
+    conversation_id: int
+    role: str | None
+    content: str | None
+    created_at: datetime | None = None
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class MountainRecord:
+    id: int
+    name: str | None
+    level: int | None
+    province: str | None
+    city: str | None
+    address: str | None
+    latitude: float | None
+    longitude: float | None
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class CourseRecord:
+    id: int
+    mountain_id: int | None
+    course_name: str | None
+    course_distance: int | None
+    course_duration: int | None
+    course_difficulty: int | None
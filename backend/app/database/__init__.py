@@ -1,23 +1,200 @@
-from sqlalchemy import ARRAY, String, Text, DateTime, Boolean, Integer, SmallInteger, Float, ForeignKey
+from sqlalchemy import ARRAY, String, Text, DateTime, Boolean, Integer, BigInteger, SmallInteger, Float, ForeignKey
 from sqlalchemy.dialects.postgresql import JSONB
-from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy import Select, Index
+from sqlalchemy.orm import DeclarativeBase, Session as OrmSession
 from sqlalchemy.orm import mapped_column, Mapped, relationship
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError, InvalidRequestError
+from collections import deque
+from contextvars import ContextVar
 from datetime import datetime, timezone
+import itertools
+import time
 
 from config import settings
 from custom_types import Gender
 
-engine = create_async_engine(settings.DB_URL, echo=False, pool_size=settings.DB_POOL_SIZE)
-async_session = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """
+    queue pool that keeps the latest checkout wait times (incl. opening a new connection) and hold times in ms,
+    to size DB_POOL_SIZE from data
+    """
+    MAX_SAMPLES = 1024
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_ms = deque(maxlen=self.MAX_SAMPLES)
+        self.hold_ms = deque(maxlen=self.MAX_SAMPLES)
+        self.checkouts = 0
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except PoolTimeoutError:
+            self.timeouts += 1
+            raise
+        now = time.perf_counter()
+        self.wait_ms.append((now - start) * 1000)
+        self.checkouts += 1
+        record.info["checked_out_at"] = now
+        return record
+
+    def _do_return_conn(self, record) -> None:
+        checked_out_at = record.info.pop("checked_out_at", None)
+        if checked_out_at is not None:
+            self.hold_ms.append((time.perf_counter() - checked_out_at) * 1000)
+        super()._do_return_conn(record)
+
+
+engine = create_async_engine(settings.DB_URL, echo=False, pool_size=settings.DB_POOL_SIZE,
+                             poolclass=InstrumentedPool)
+
+# set per request (see dependencies.read_your_writes) to keep every read of that request on the primary
+read_your_writes: ContextVar[bool] = ContextVar("read_your_writes", default=False)
+
+
+def autocommit(async_engine):
+    # same pool, but reads run without BEGIN / COMMIT round trips
+    return async_engine.sync_engine.execution_options(isolation_level="AUTOCOMMIT")
+
+
+class ReplicaSet:
+    """
+    optional read replicas (DB_REPLICA_URLS, comma separated), each with its own pool.
+
+    strategy:
+        round_robin: next replica in turn
+        least_busy: replica with the fewest checked out connections
+    """
+    def __init__(self, urls: list[str], pool_size: int, strategy: str):
+        if strategy not in ("round_robin", "least_busy"):
+            raise ValueError(f"unknown replica strategy: {strategy}")
+        self.strategy = strategy
+        self.engines = [create_async_engine(url, echo=False, pool_size=pool_size, poolclass=InstrumentedPool)
+                        for url in urls]
+        self._round_robin = itertools.cycle(self.engines)
+
+    def __bool__(self) -> bool:
+        return bool(self.engines)
+
+    def choose(self):
+        if self.strategy == "least_busy":
+            return min(self.engines, key=lambda e: e.sync_engine.pool.checkedout())
+        return next(self._round_robin)
+
+
+replicas = ReplicaSet([url.strip() for url in settings.DB_REPLICA_URLS.split(",") if url.strip()],
+                      pool_size=settings.DB_REPLICA_POOL_SIZE,
+                      strategy=settings.DB_REPLICA_STRATEGY)
+# sync engine -> its autocommit twin (same pool)
+read_binds = {e.sync_engine: autocommit(e) for e in [engine, *replicas.engines]}
+
+
+class RoutingSession(OrmSession):
+    """
+    a session runs on one connection, picked by its first statement:
+        - sessions opened with info={"use_primary": True} (everything that writes, and reads that must not lag)
+          and requests flagged read_your_writes: one transaction on the primary from the start, so reads see
+          the same snapshot as the writes and SELECT ... FOR UPDATE locks what the write is based on
+        - read-only sessions: plain SELECTs in autocommit on a replica (the primary when there is none), without
+          BEGIN / COMMIT. a server side cursor (yield_per / stream_results) can't live outside a transaction,
+          so when the first statement streams the session gets a transactional connection to the replica instead.
+    a read-only session whose first statement writes goes to the primary. once it holds a read connection it
+    can't write (or stream from an autocommit one) without a second connection, that raises instead.
+    """
+    def get_bind(self, mapper=None, clause=None, **kw):
+        writes = (self._flushing or not isinstance(clause, Select) or clause._for_update_arg is not None)
+        if self.info.get("use_primary") or read_your_writes.get():
+            self.info["wrote"] = self.info.get("wrote") or writes
+            return engine.sync_engine
+
+        bind = self.info.get("bind")
+        streams = not writes and bool(clause.get_execution_options().keys() & {"stream_results", "yield_per"})
+        if bind is None:
+            if writes:
+                bind = engine.sync_engine
+            else:
+                source = (replicas.choose() if replicas else engine).sync_engine
+                bind = source if streams else read_binds[source]
+            self.info["bind"] = bind
+        elif (writes and bind is not engine.sync_engine) or (streams and bind in read_binds.values()):
+            raise InvalidRequestError("read-only session already holds a read connection, "
+                                      "open sessions that write or stream with use_primary=True")
+        self.info["wrote"] = self.info.get("wrote") or writes
+        return bind
+
+
+async_session = async_sessionmaker(bind=engine, expire_on_commit=False, sync_session_class=RoutingSession)
 
 
 class Base(AsyncAttrs, DeclarativeBase):
     pass
 
 
+# column defaults take the function itself, so every row gets the time it is written (not the import time)
+def now_jst() -> datetime:
+    return datetime.now(settings.CONST.TIMEZONE)
+
+
+def notify_trigger_ddl(table: str, channel: str, events: str, column: str | tuple[str, ...],
+                       name: str | None = None) -> list[str]:
+    """
+    DDL for a row trigger that sends pg_notify(channel, <column of the changed row>) on the given events
+    (e.g. "UPDATE OR DELETE"). several columns are sent joined by ":".
+    name (default "<table>_changed") names the function / trigger, so one table can have several.
+    every statement is idempotent so it can run on every deploy.
+    """
+    columns = (column,) if isinstance(column, str) else column
+    name = name or f"{table}_changed"
+
+    def payload(row: str) -> str:
+        return " || ':' || ".join(f"{row}.{c}::text" for c in columns)
+
+    return [
+        f"""
+        CREATE OR REPLACE FUNCTION notify_{name}() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('{channel}', {payload("OLD")});
+            ELSE
+                PERFORM pg_notify('{channel}', {payload("NEW")});
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        f"DROP TRIGGER IF EXISTS trg_{name} ON {table}",
+        f"CREATE TRIGGER trg_{name} AFTER {events} ON {table} "
+        f"FOR EACH ROW EXECUTE FUNCTION notify_{name}()",
+    ]
+
+
+# row changes are broadcast on these channels so every worker can refresh its in-memory state
+USER_CHANGED_CHANNEL = "t_user_changed"
+REVOKED_TOKEN_ADDED_CHANNEL = "t_revoked_token_added"
+MESSAGE_ADDED_CHANNEL = "t_message_added"
+MESSAGE_CHANGED_CHANNEL = "t_message_changed"
+MOUNTAIN_CHANGED_CHANNEL = "t_mountain_changed"
+TOUR_CHANGED_CHANNEL = "t_tour_changed"
+TOUR_COURSE_CHANGED_CHANNEL = "t_tour_course_changed"
+NOTIFY_TRIGGER_DDL = [
+    *notify_trigger_ddl("t_user", USER_CHANGED_CHANNEL, "UPDATE OR DELETE", "id"),
+    *notify_trigger_ddl("t_revoked_token", REVOKED_TOKEN_ADDED_CHANNEL, "INSERT", "token_id"),
+    *notify_trigger_ddl("t_message", MESSAGE_ADDED_CHANNEL, "INSERT", ("conversation_id", "id"),
+                        name="t_message_added"),
+    *notify_trigger_ddl("t_message", MESSAGE_CHANGED_CHANNEL, "UPDATE OR DELETE", "conversation_id"),
+    *notify_trigger_ddl("t_mountain", MOUNTAIN_CHANGED_CHANNEL, "INSERT OR UPDATE OR DELETE", "id"),
+    *notify_trigger_ddl("t_tour", TOUR_CHANGED_CHANNEL, "INSERT OR UPDATE OR DELETE", "id"),
+    *notify_trigger_ddl("t_tour_course", TOUR_COURSE_CHANGED_CHANNEL, "INSERT OR UPDATE OR DELETE", "id"),
+]
+
+
 class User(Base):
     __tablename__ = 't_user'
 
@@ -28,9 +205,9 @@ class User(Base):
     hashed_password: Mapped[str] = mapped_column(String(128), nullable=True, insert_default=None)
     base_info: Mapped["UserBaseInfo"] = relationship(back_populates="user", cascade="all, delete")
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True,
-                                                 insert_default=datetime.now(settings.CONST.TIMEZONE))
+                                                 insert_default=now_jst)
     update_datetime: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True,
-                                                      onupdate=datetime.now(settings.CONST.TIMEZONE))
+                                                      onupdate=now_jst)
 
     @property
     def is_active(self) -> bool:
@@ -41,13 +218,61 @@ class UserAuthProvider(Base):
     __tablename__ = 't_user_auth_provider'
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    user_id: Mapped[str] = mapped_column(ForeignKey("t_user.id", ondelete="CASCADE"), nullable=True)
+    user_id: Mapped[str] = mapped_column(ForeignKey("t_user.id", ondelete="CASCADE"), nullable=True, index=True)
     provider: Mapped[str] = mapped_column(String(64), nullable=False)
     provider_id: Mapped[str] = mapped_column(String(128), nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True,
-                                                 insert_default=datetime.now(settings.CONST.TIMEZONE))
+                                                 insert_default=now_jst)
     update_datetime: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True,
-                                                      onupdate=datetime.now(settings.CONST.TIMEZONE))
+                                                      onupdate=now_jst)
+
+
+class RevokedToken(Base):
+    __tablename__ = "t_revoked_token"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    token_id: Mapped[str] = mapped_column(String(64), unique=True, nullable=False,
+                                          comment="revoked refresh token family id")
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True,
+                                                 insert_default=now_jst)
+
+
+class RefreshTokenFamily(Base):
+    """the generation of the newest refresh token of a login, advanced in place on every rotation"""
+    __tablename__ = "t_refresh_token_family"
+
+    family_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    generation: Mapped[int] = mapped_column(Integer, nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, index=True)
+
+
+class SchemaVersion(Base):
+    __tablename__ = "t_schema_version"
+
+    id: Mapped[int] = mapped_column(SmallInteger, primary_key=True, default=1)
+    version: Mapped[str] = mapped_column(String(64), nullable=False, comment="sha256 of the schema DDL")
+    applied_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True,
+                                                 insert_default=now_jst, onupdate=now_jst)
+
+
+class DigestNonce(Base):
+    """the last nc accepted for a digest auth nonce, shared so a request can't be replayed on another worker"""
+    __tablename__ = "t_digest_nonce"
+
+    nonce: Mapped[str] = mapped_column(String(64), primary_key=True)
+    last_nc: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, index=True)
+
+
+class AppSetting(Base):
+    """values decided once and shared by every worker (e.g. the calibrated bcrypt cost)"""
+    __tablename__ = "t_app_setting"
+
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    value: Mapped[dict] = mapped_column(JSONB, nullable=False)
+    update_datetime: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True,
+                                                      insert_default=now_jst, onupdate=now_jst)
 
 
 class UserBaseInfo(Base):
@@ -62,16 +287,20 @@ class UserBaseInfo(Base):
     city_id: Mapped[int] = mapped_column(Integer, nullable=True)
     district_id: Mapped[int] = mapped_column(Integer, nullable=True)
     address: Mapped[str] = mapped_column(String(128), nullable=True)
-    user_id: Mapped[str] = mapped_column(ForeignKey("t_user.id", ondelete="CASCADE"), nullable=True)
+    user_id: Mapped[str] = mapped_column(ForeignKey("t_user.id", ondelete="CASCADE"), nullable=True, index=True)
     user: Mapped["User"] = relationship(back_populates="base_info", passive_deletes=True)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True,
-                                                  insert_default=datetime.now(settings.CONST.TIMEZONE))
+                                                  insert_default=now_jst)
     update_datetime: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True,
-                                                      onupdate=datetime.now(settings.CONST.TIMEZONE))
+                                                      onupdate=now_jst)
 
 
 class Quota(Base):
     __tablename__ = "t_quota"
+    __table_args__ = (
+        # one row per user, also the conflict target of the row created on a user's first guarded request
+        Index("uq_t_quota_user_id", "user_id", unique=True),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[str] = mapped_column(String(60), nullable=False)
@@ -79,9 +308,9 @@ class Quota(Base):
     used_quota: Mapped[int] = mapped_column(Integer)
     last_reset: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True,
-                                                  insert_default=datetime.now(settings.CONST.TIMEZONE))
+                                                  insert_default=now_jst)
     update_datetime: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True,
-                                                      onupdate=datetime.now(settings.CONST.TIMEZONE))
+                                                      onupdate=now_jst)
 
     @property
     def left_quota(self) -> int:
@@ -94,27 +323,35 @@ class Quota(Base):
 
 class Conversation(Base):
     __tablename__ = "t_conversation"
+    __table_args__ = (
+        # a user's conversations, newest (highest id) first
+        Index("ix_t_conversation_user_id_id", "user_id", "id"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[str] = mapped_column(String(60), nullable=False)
     closed: Mapped[bool] = mapped_column(Boolean, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True,
-                                                  insert_default=datetime.now(settings.CONST.TIMEZONE))
+                                                  insert_default=now_jst)
     update_datetime: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True,
-                                                      onupdate=datetime.now(settings.CONST.TIMEZONE))
+                                                      onupdate=now_jst)
 
 
 class Message(Base):
     __tablename__ = "t_message"
+    __table_args__ = (
+        # keyset pagination of a conversation's history on (conversation_id, id)
+        Index("ix_t_message_conversation_id_id", "conversation_id", "id"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     content: Mapped[str] = mapped_column(Text, nullable=True)
     role: Mapped[str] = mapped_column(String(64), nullable=True)
     conversation_id: Mapped[int] = mapped_column(Integer, nullable=False)
     created_at : Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True,
-                                                  insert_default=datetime.now(settings.CONST.TIMEZONE))
+                                                  insert_default=now_jst)
     update_datetime: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True,
-                                                      onupdate=datetime.now(settings.CONST.TIMEZONE))
+                                                      onupdate=now_jst)
 
 
 class Mountain(Base):
@@ -129,16 +366,16 @@ class Mountain(Base):
     latitude: Mapped[float] = mapped_column(Float, nullable=True)
     longitude: Mapped[float] = mapped_column(Float, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True,
-                                                  insert_default=datetime.now(settings.CONST.TIMEZONE))
+                                                  insert_default=now_jst)
     update_datetime: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True,
-                                                      onupdate=datetime.now(settings.CONST.TIMEZONE))
+                                                      onupdate=now_jst)
 
 
 class TourCourse(Base):
     __tablename__ = "t_tour_course"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    mountain_id: Mapped[int] = mapped_column(Integer, nullable=True)
+    mountain_id: Mapped[int] = mapped_column(Integer, nullable=True, index=True)
     course_name: Mapped[str] = mapped_column(String(64), nullable=True)
     course_distance: Mapped[int] = mapped_column(Integer, nullable=True)
     course_duration: Mapped[int] = mapped_column(Integer, nullable=True)
@@ -147,12 +384,16 @@ class TourCourse(Base):
 
 class Tour(Base):
     __tablename__ = "t_tour"
+    __table_args__ = (
+        # a user's tours by date (also serves the user_id foreign key on user delete)
+        Index("ix_t_tour_user_id_tour_date", "user_id", "tour_date"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     name: Mapped[str] = mapped_column(String(64), nullable=True)
     user_id: Mapped[str] = mapped_column(ForeignKey("t_user.id", ondelete="CASCADE"), nullable=True)
     tour_date: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
-    mountain_id: Mapped[int] = mapped_column(Integer, nullable=True)
+    mountain_id: Mapped[int] = mapped_column(Integer, nullable=True, index=True)
     tour_up_duration: Mapped[int] = mapped_column(Integer, nullable=True)
     tour_up_course_id: Mapped[int] = mapped_column(Integer, nullable=True)
     tour_down_duration: Mapped[int] = mapped_column(Integer, nullable=True)
@@ -160,7 +401,7 @@ class Tour(Base):
     tour_distance: Mapped[int] = mapped_column(Integer, nullable=True)
     tour_difficulty: Mapped[int] = mapped_column(Integer, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True,
-                                                  insert_default=datetime.now(settings.CONST.TIMEZONE))
+                                                  insert_default=now_jst)
     update_datetime: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True,
-                                                      onupdate=datetime.now(settings.CONST.TIMEZONE))
+                                                      onupdate=now_jst)
 
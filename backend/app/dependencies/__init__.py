@@ -1,4 +1,5 @@
 from .type_dependency import (Database,
+                              PrimaryDatabase,
                               FormData,
                               ExternalUser,
                               InternalUser,
@@ -6,5 +7,5 @@ from .type_dependency import (Database,
                               ExternalAccess,
                               InternalAccess,
                               AdminAccess)
-from .router_level_dependency import ip_whitelist
+from .router_level_dependency import ip_whitelist, read_your_writes
 from .endpoint_function_dependency import check_refresh_token
@@ -1,11 +1,16 @@
 from fastapi import Depends, Cookie
 from fastapi.security import OAuth2PasswordBearer
 from typing import Annotated
+import dataclasses
+import hashlib
+import time
 import jwt
 import jwt.algorithms
 from jwt.exceptions import InvalidTokenError
 
-from utils.crud_util import Session
+from utils.cache_util import TTLLRUCache
+from utils.user_cache_util import user_principal_cache
+from utils.jwt_key_util import jwt_key_ring
 from exceptions import TokenInvalidError, ForbiddenError
 from custom_types import CurrentUser
 from config import settings
@@ -16,32 +21,61 @@ SECRET_KEY = settings.SECRET_KEY
 REFRESH_SECRET_KEY = settings.REFRESH_SECRET_KEY
 ALGORITHM = settings.ALGORITHM
 
+# sha256(token) -> decoded claims, entries expire together with the token's own "exp"
+verified_token_cache = TTLLRUCache("verified_token", max_size=settings.VERIFIED_TOKEN_CACHE_SIZE)
 
-def check_auth(*, access_level: int, get_user: bool = True) -> CurrentUser | None:
-    async def func(token: Annotated[str, Depends(oauth2_scheme)]):
-        try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            user_guid: str = payload.get("sub")
-            authority_code: int = payload.get("aut", None)
 
-            if user_guid is None or authority_code is None:
+async def decode_access_token(token: str) -> dict:
+    token_digest = hashlib.sha256(token.encode("utf-8")).digest()
+    payload = verified_token_cache.get(token_digest)
+    if payload is not None:
+        return payload
+
+    try:
+        kid = jwt.get_unverified_header(token).get("kid")
+        if kid is None:
+            # legacy HS256 tokens, only until the asymmetric keys have been in use for one token lifetime
+            if not jwt_key_ring.hs256_accepted():
+                raise TokenInvalidError
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        else:
+            key = await jwt_key_ring.verification_key(kid)
+            if key is None:
                 raise TokenInvalidError
+            payload = jwt.decode(token, key.public_key, algorithms=[key.algorithm])
+    except InvalidTokenError:
+        raise TokenInvalidError
+
+    # tokens without exp are never cached, they would live until evicted. kid-less HS256 tokens drop out
+    # when the HS256 grace window closes at the latest, and after one token lifetime while there's no key yet
+    if isinstance(payload.get("exp"), (int, float)):
+        expires_at = payload["exp"]
+        if kid is None:
+            expires_at = min(expires_at, jwt_key_ring.hs256_cutoff(), time.time() + jwt_key_ring.hs256_grace_seconds)
+        verified_token_cache.set(token_digest, payload, expires_at)
+    return payload
 
-            if authority_code > access_level:
-                raise ForbiddenError
 
-            yield None
-        except InvalidTokenError:
+def check_auth(*, access_level: int, get_user: bool = True) -> CurrentUser | None:
+    async def func(token: Annotated[str, Depends(oauth2_scheme)]):
+        payload = await decode_access_token(token)
+        user_guid: str = payload.get("sub")
+        authority_code: int = payload.get("aut", None)
+
+        if user_guid is None or authority_code is None:
             raise TokenInvalidError
 
-        if get_user:
-            async with Session() as db:
-                user = await db.get_user_by_user_guid(user_guid)
-                if user is None:
-                    raise TokenInvalidError
+        if authority_code > access_level:
+            raise ForbiddenError
+
+        if not get_user:
+            return None
+
+        user = await user_principal_cache.get_user(user_guid)
+        if user is None:
+            raise TokenInvalidError
 
-                setattr(user, "id_token", token)
-                yield user
+        return dataclasses.replace(user, id_token=token)
 
     return func
 
@@ -1,5 +1,6 @@
 from fastapi import Request
 from config import settings
+from database import read_your_writes as read_your_writes_flag
 from exceptions import ForbiddenError
 
 from utils import logger
@@ -17,3 +18,10 @@ def ip_whitelist(request: Request):
 
     if client_ip not in ALLOWED_IPS:
         raise ForbiddenError("your ip is not allowed")
+
+
+
+async def read_your_writes():
+    # keeps every read of the request on the primary.
+    # async on purpose: a sync dependency runs in a thread and the flag would not reach the endpoint
+    read_your_writes_flag.set(True)
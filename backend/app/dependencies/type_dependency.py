@@ -3,13 +3,14 @@ from typing import Annotated
 from schemas.auth import EmailForm
 
 
-from utils.crud_util import Session, get_session
-from utils.auth_util import decrypt_password
+from utils.crud_util import Session, get_session, get_primary_session
+from utils.auth_util import decrypt_password, decrypt_handshake_password, HANDSHAKE_PREFIX
 from .endpoint_function_dependency import check_auth
 from custom_types import CurrentUser
 
 
 Database = Annotated[Session, Depends(get_session)]
+PrimaryDatabase = Annotated[Session, Depends(get_primary_session)]
 
 ExternalUser = Annotated[CurrentUser, Depends(check_auth(access_level=4))]
 InternalUser = Annotated[CurrentUser, Depends(check_auth(access_level=3))]
@@ -23,7 +24,10 @@ AdminAccess = Annotated[None, Depends(check_auth(access_level=0, get_user=False)
 
 
 async def get_decrypted_form_data(FormData: Annotated[EmailForm, Form()]) -> tuple[str, str]:
-    decrypted = decrypt_password(FormData.password.encode("utf-8"))
+    if FormData.password.startswith(HANDSHAKE_PREFIX):
+        decrypted = decrypt_handshake_password(FormData.password)
+    else:
+        decrypted = decrypt_password(FormData.password.encode("utf-8"))
     return FormData.username, decrypted.split(":")[0]
 
 
@@ -89,9 +89,25 @@ class UnprocessableEntityError(HTTPException):
         HTTPException(status_code=self.status_code, detail=self.detail, headers=self.headers)
 
 
+class QuotaExceededError(HTTPException):
+    def __init__(self, detail=None, headers=None):
+        self.status_code = status.HTTP_429_TOO_MANY_REQUESTS
+        self.detail = "quota exceeded" if detail is None else detail
+        self.headers = headers
+        HTTPException(status_code=self.status_code, detail=self.detail, headers=self.headers)
+
+
 class InternalServerError(HTTPException):
     def __init__(self, detail=None, headers=None):
         self.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
         self.detail = "server error happened" if detail is None else detail
         self.headers = headers
         HTTPException(status_code=self.status_code, detail=self.detail, headers=self.headers)
+
+
+class ServiceUnavailableError(HTTPException):
+    def __init__(self, detail=None, headers=None):
+        self.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        self.detail = "service is busy, try again later" if detail is None else detail
+        self.headers = headers
+        HTTPException(status_code=self.status_code, detail=self.detail, headers=self.headers)
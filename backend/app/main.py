@@ -1,14 +1,12 @@
-from fastapi import FastAPI, Request, Response, status
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import HTTPException, RequestValidationError
 from contextlib import asynccontextmanager
-from typing import Any
-import orjson
 
 from middlewares import *
 from config import settings
 from utils.logger_util import logger
+from utils.response_util import CustomORJSONResponse
 
 
 # startup and end event
@@ -19,24 +17,34 @@ async def lifespan(__app: FastAPI):
     import asyncio
     logger.info(f"Using event loop: {asyncio.get_running_loop()}")
 
-    # create db tables and metadata
-    import socket
-    from database import Base, engine
-    try:
-        async with engine.begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
-    except (socket.gaierror, OSError) as e:
-        logger.warning(f"db disconnected. error message: {e}")
+    # schema is created once per deploy (python -m utils.schema_util, or the first worker under an advisory lock),
+    # workers only compare the version stamp. an unreachable database or an outdated schema stops the startup
+    from utils.schema_util import check_schema_version
+    if not await check_schema_version(auto_migrate=settings.DB_MIGRATE_ON_STARTUP):
+        raise RuntimeError("database schema doesn't match this build, run `python -m utils.schema_util` first")
 
-    yield
+    # the bcrypt cost shared by every worker (measured once on this hardware) before serving logins
+    from utils.auth_util import password_hash_executor, bulk_hash_executor, calibrate_bcrypt_rounds
+    await calibrate_bcrypt_rounds()
+
+    # access token keys are read before the first token is signed (file reads run in a thread)
+    from utils.jwt_key_util import jwt_key_ring
+    await jwt_key_ring.reload()
 
+    # keep per-worker caches in sync with t_user / t_revoked_token changes made by any worker
+    from utils.notify_util import pg_listener
+    pg_listener.start()
 
-# custom default response type
-class CustomORJSONResponse(Response):
-    media_type = "application/json"
+    # hands back unused quota reservations and runs the chunked quota reset sweep
+    from utils.quota_util import quota_service
+    quota_service.start()
+
+    yield
 
-    def render(self, content: Any) -> bytes:
-        return orjson.dumps(jsonable_encoder(content), option=orjson.OPT_NON_STR_KEYS | orjson.OPT_OMIT_MICROSECONDS)
+    await quota_service.stop()
+    await pg_listener.stop()
+    password_hash_executor.shutdown()
+    bulk_hash_executor.shutdown()
 
 
 app = FastAPI(lifespan=lifespan, default_response_class=CustomORJSONResponse)
@@ -1,6 +1,8 @@
 from .login import router as login_router
 from .openai import router as openai_router
 from .user import router as user_router
+from .mountain import router as mountain_router
+from .tour import router as tour_router
 
 from config import settings
 
@@ -12,6 +14,8 @@ router = APIRouter(prefix=f"/api/{settings.CONST.API_VER}")
 router.include_router(login_router, prefix="/account", tags=["login"])
 router.include_router(openai_router, prefix="/openai", tags=["openai"])
 router.include_router(user_router, prefix="/users", tags=["user"])
+router.include_router(mountain_router, prefix="/mountains", tags=["mountain"])
+router.include_router(tour_router, prefix="/tours", tags=["tour"])
 
 import os
 from .private import router as private_router
@@ -2,32 +2,28 @@ from fastapi import APIRouter, status, Depends, Response
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
 from typing import Annotated
+from sqlalchemy.exc import IntegrityError
 
 from schemas.auth import TokenSchema
 from schemas.user import UserCreateSchema, UserOutSchema
-from dependencies import Database, FormData, check_refresh_token
-from utils.auth_util import create_access_token, create_refresh_token, authenticate_user, get_password_hash, RSA_PUBLIC_KEY
-from exceptions import AuthorizationError
+from dependencies import PrimaryDatabase, FormData, check_refresh_token, read_your_writes
+from utils.auth_util import create_access_token, create_refresh_token, authenticate_user, get_password_hash, RSA_PUBLIC_KEY, handshake_key_ring
+from utils.revocation_util import refresh_token_revocation
+from utils.jwt_key_util import jwt_key_ring
+from utils.response_util import CustomORJSONResponse
+from exceptions import AuthorizationError, AlreadyExistError
 
 
 router = APIRouter()
 
 
-@router.post(path="/login",
-             response_model=TokenSchema,
-             status_code=status.HTTP_200_OK)
-async def login_for_access_token(
-    form_data: FormData,
-):
-    username, password = form_data
-    user = await authenticate_user(username, password)
-    if user is None:
-        raise AuthorizationError("username or password is incorrect")
+TOKEN_CLAIMS = ("sub", "username", "aut", "created_at")
 
-    token_data = {"sub": user.id, "username": user.username, "aut": user.authority_level, "created_at": user.created_at}
 
-    access_token = create_access_token(jsonable_encoder(token_data))
-    refresh_token = create_refresh_token(jsonable_encoder(token_data))
+def token_response(token_data: dict, family_id: str | None = None, generation: int = 0) -> JSONResponse:
+    token_data = jsonable_encoder({k: token_data.get(k) for k in TOKEN_CLAIMS})
+    access_token = create_access_token(token_data)
+    refresh_token = create_refresh_token(token_data, family_id, generation)
 
     # 设置cookie
     response = JSONResponse({"access_token": access_token, "token_type": "bearer"})
@@ -45,28 +41,72 @@ async def login_for_access_token(
     return response
 
 
+@router.post(path="/login",
+             response_model=TokenSchema,
+             status_code=status.HTTP_200_OK,
+             dependencies=[Depends(read_your_writes)])  # a login right after signup must find the new user
+async def login_for_access_token(
+    form_data: FormData,
+):
+    username, password = form_data
+    user = await authenticate_user(username, password)
+    if user is None:
+        raise AuthorizationError("username or password is incorrect")
+
+    token_data = {"sub": user.id, "username": user.username, "aut": user.authority_level, "created_at": user.created_at}
+    return token_response(token_data)
+
+
 @router.get(path="/publickey")
 async def get_public_key():
     return Response(content=RSA_PUBLIC_KEY, media_type="text/plain")
 
 
+# plain dicts: returned as the response so they skip FastAPI's jsonable_encoder pass
+@router.get(path="/jwks")
+async def get_jwks():
+    return CustomORJSONResponse(jwt_key_ring.jwks())
+
+
+@router.get(path="/handshake_key")
+async def get_handshake_key():
+    return CustomORJSONResponse(handshake_key_ring.public_key())
+
+
 @router.post(path="/signup",
              response_model=UserOutSchema)
 async def register_user(
-        db: Database,
+        db: PrimaryDatabase,
         form_data: FormData,
 ):
     username, password = form_data
-    body_user = UserCreateSchema(username=username, hashed_password=get_password_hash(password))
-    await db.add_user(body_user)
+    body_user = UserCreateSchema(username=username, hashed_password=await get_password_hash(password))
+    try:
+        user = await db.add_user(body_user)
+    except IntegrityError:
+        raise AlreadyExistError("username already exists")
     await db.commit()
 
-    return await login_for_access_token((username, password))
+    # the new row already has everything the tokens need, no second lookup / bcrypt verify
+    token_data = {"sub": user.id, "username": user.username, "aut": user.authority_level, "created_at": user.created_at}
+    return token_response(token_data)
 
 @router.post(path="/refresh_token")
 async def refresh_token(
     refresh_token_payload: Annotated[dict, Depends(check_refresh_token)]
 ):
-    access_token = create_access_token(jsonable_encoder(refresh_token_payload))
-    
-    return {"access_token": access_token, "token_type": "bearer"}
+    family_id, generation = await refresh_token_revocation.rotate(refresh_token_payload)
+    return token_response(refresh_token_payload, family_id, generation)
+
+
+@router.post(path="/logout")
+async def logout(
+    refresh_token_payload: Annotated[dict, Depends(check_refresh_token)]
+):
+    family_id = refresh_token_payload.get("fam")
+    if family_id is not None:
+        await refresh_token_revocation.revoke_family(family_id)
+
+    response = JSONResponse({"status": "OK"})
+    response.delete_cookie(key="refresh_token", path="/")
+    return response
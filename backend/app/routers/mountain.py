@@ -0,0 +1,49 @@
+from fastapi import APIRouter, status, Query
+import dataclasses
+
+from config import settings
+from schemas.mountain import NearbyMountainSchema, MountainSearchResultSchema
+from utils.mountain_util import mountain_catalog, mountain_spatial_index, mountain_search_index
+from utils.response_util import CustomORJSONResponse
+
+
+router = APIRouter()
+
+
+@router.get(path="/nearby",
+            response_model=None,
+            responses={status.HTTP_200_OK: {"model": list[NearbyMountainSchema]}},
+            status_code=status.HTTP_200_OK)
+async def get_nearby_mountains(
+    latitude: float = Query(ge=-90, le=90),
+    longitude: float = Query(ge=-180, le=180),
+    radius_km: float | None = Query(default=None, gt=0),
+    limit: int = Query(default=settings.DEFAULT_PAGE_SIZE, ge=1, le=settings.MAX_PAGE_SIZE),
+):
+    """
+    nearest mountains first. with radius_km only the ones within it, otherwise the `limit` nearest
+    """
+    await mountain_catalog.ensure_loaded()
+    if radius_km is None:
+        found = mountain_spatial_index.nearest(latitude, longitude, limit)
+    else:
+        found = mountain_spatial_index.within(latitude, longitude, radius_km, limit)
+    return CustomORJSONResponse([{**dataclasses.asdict(mountain), "distance_km": round(distance, 3)}
+                                 for mountain, distance in found])
+
+
+@router.get(path="/search",
+            response_model=None,
+            responses={status.HTTP_200_OK: {"model": list[MountainSearchResultSchema]}},
+            status_code=status.HTTP_200_OK)
+async def search_mountains(
+    q: str = Query(min_length=1, max_length=64),
+    limit: int = Query(default=10, ge=1, le=settings.MAX_PAGE_SIZE),
+):
+    """
+    search-as-you-type over mountain names (fuzzy / prefix) and province / city prefixes
+    """
+    await mountain_catalog.ensure_loaded()
+    found = mountain_search_index.search(q, limit)
+    return CustomORJSONResponse([{**dataclasses.asdict(mountain), "score": round(score, 3)}
+                                 for mountain, score in found])
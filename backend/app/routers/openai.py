@@ -1,7 +1,10 @@
 from fastapi import APIRouter, status, Depends
 from typing import Annotated
 
-from dependencies import Database
+from dependencies import Database, ExternalUser, read_your_writes
+from schemas.conversation import MessagePageSchema
+from exceptions import NotFoundError
+from config import settings
 
 
 router = APIRouter()
@@ -10,3 +13,22 @@ router = APIRouter()
 @router.post("/message")
 async def post_message(msg: str):
     return f"你输入了{msg}"
+
+
+@router.get(path="/conversations/{conversation_id}/messages",
+            response_model=MessagePageSchema,
+            status_code=status.HTTP_200_OK,
+            dependencies=[Depends(read_your_writes)])  # the turn just posted must be in the history
+async def get_messages(
+    conversation_id: int,
+    db: Database,
+    user: ExternalUser,
+    limit: int = settings.DEFAULT_PAGE_SIZE,
+    cursor: str | None = None,
+):
+    conversation = await db.get_conversation(conversation_id)
+    if conversation is None or conversation.user_id != user.id:
+        raise NotFoundError("conversation not found")
+
+    messages, next_cursor = await db.get_messages_page(conversation_id, limit=limit, cursor=cursor)
+    return {"messages": messages, "next_cursor": next_cursor}
@@ -1,3 +1,35 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 
-router = APIRouter()
+from dependencies import ip_whitelist
+from dependencies.endpoint_function_dependency import verified_token_cache
+from utils.auth_util import password_hash_executor, bulk_hash_executor, bcrypt_policy
+from utils.user_cache_util import user_principal_cache
+from utils.revocation_util import refresh_token_revocation
+from utils.conversation_util import conversation_tail_cache
+from utils.quota_util import quota_service
+from utils.mountain_util import mountain_catalog
+from utils.tour_stats_util import tour_stats
+from utils.course_util import course_recommender
+from utils.crud_util import BaseSession, get_pool_stats
+from utils.response_util import CustomORJSONResponse
+
+router = APIRouter(prefix="/private", dependencies=[Depends(ip_whitelist)])
+
+
+@router.get(path="/metrics")
+async def get_metrics():
+    return CustomORJSONResponse({
+        "password_hash": password_hash_executor.stats(),
+        "password_import": bulk_hash_executor.stats(),
+        "bcrypt_policy": bcrypt_policy,
+        "verified_token_cache": verified_token_cache.stats(),
+        "user_principal_cache": user_principal_cache.stats(),
+        "refresh_token_revocation": refresh_token_revocation.stats(),
+        "statement_cache": BaseSession.statement_cache.stats(),
+        "conversation_tail_cache": conversation_tail_cache.stats(),
+        "quota": quota_service.stats(),
+        "mountain_catalog": mountain_catalog.stats(),
+        "tour_stats": tour_stats.stats(),
+        "course_recommender": course_recommender.stats(),
+        "db_pools": get_pool_stats(),
+    })
@@ -0,0 +1,65 @@
+from fastapi import APIRouter, status, Query
+
+from config import settings
+from dependencies import ExternalUser
+from schemas.tour import UserTourStatsSchema, LeaderboardEntrySchema, CourseRecommendationSchema
+from utils.tour_stats_util import tour_stats
+from utils.course_util import course_recommender
+from utils.response_util import CustomORJSONResponse
+
+
+router = APIRouter()
+
+
+@router.get(path="/stats/me",
+            response_model=None,
+            responses={status.HTTP_200_OK: {"model": UserTourStatsSchema}},
+            status_code=status.HTTP_200_OK)
+async def get_my_tour_stats(user: ExternalUser):
+    """
+    totals of the current user, all time and per month (newest first)
+    """
+    await tour_stats.ensure_loaded()
+    return CustomORJSONResponse(tour_stats.get_user_stats(user.id))
+
+
+@router.get(path="/leaderboard",
+            response_model=None,
+            responses={status.HTTP_200_OK: {"model": list[LeaderboardEntrySchema]}},
+            status_code=status.HTTP_200_OK)
+async def get_tour_leaderboard(
+    month: str | None = Query(default=None, pattern=r"^\d{4}-\d{2}$"),
+    mountain_id: int | None = None,
+    limit: int = Query(default=10, ge=1, le=tour_stats.LEADERBOARD_SIZE),
+):
+    """
+    top users by distance for a month (YYYY-MM, JST), a mountain or all time
+    """
+    await tour_stats.ensure_loaded()
+    board = tour_stats.leaderboard(month=month, mountain_id=mountain_id, limit=limit)
+    return CustomORJSONResponse([{**stats.to_dict(), "rank": rank, "user_id": user_id}
+                                 for rank, (user_id, stats) in enumerate(board, start=1)])
+
+
+@router.get(path="/courses/recommend",
+            response_model=None,
+            responses={status.HTTP_200_OK: {"model": list[CourseRecommendationSchema]}},
+            status_code=status.HTTP_200_OK)
+async def recommend_courses(
+    latitude: float = Query(ge=-90, le=90),
+    longitude: float = Query(ge=-180, le=180),
+    radius_km: float = Query(default=50, gt=0, le=1000),
+    max_duration: int | None = Query(default=None, gt=0, description="minutes"),
+    max_difficulty: int | None = Query(default=None, ge=0),
+    limit: int = Query(default=10, ge=1, le=settings.MAX_PAGE_SIZE),
+):
+    """
+    courses that fit the time budget and difficulty limit within radius_km, best fit first
+    """
+    await course_recommender.ensure_loaded()
+    found = course_recommender.recommend(latitude, longitude, radius_km,
+                                         max_duration=max_duration, max_difficulty=max_difficulty, limit=limit)
+    # the records are dataclasses, orjson serializes them as they are
+    return CustomORJSONResponse([{"course": course, "mountain": mountain,
+                                  "distance_km": round(distance, 3), "score": round(score, 4)}
+                                 for course, mountain, distance, score in found])
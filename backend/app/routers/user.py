@@ -1,13 +1,52 @@
-from fastapi import APIRouter, status
+from fastapi import APIRouter, status, Depends
 import time
 
-from dependencies import Database
-from exceptions import NotFoundError
+from config import settings
+from dependencies import Database, PrimaryDatabase, AdminAccess, ExternalUser, read_your_writes
+from schemas.user import (UserCreateSchema, UserImportSchema, UserImportResultSchema,
+                          UserProfileSchema, UserProfilePageSchema)
+from utils.auth_util import get_password_hashes
+from exceptions import NotFoundError, BadRequestError
+from utils.response_util import CustomORJSONResponse
 
 router = APIRouter()
 
-@router.get(path="/exists",
+# the profile endpoints return UserProfile dtos built from row tuples straight to orjson: no response_model
+# validation, no jsonable_encoder. the schemas only document the response
+
+
+@router.get(path="/me",
+            response_model=None,
+            responses={status.HTTP_200_OK: {"model": UserProfileSchema}},
+            status_code=status.HTTP_200_OK,
+            dependencies=[Depends(read_your_writes)])
+async def get_my_profile(
+    db: Database,
+    user: ExternalUser,
+):
+    profile = await db.get_user_base_info(user.id)
+    if profile is None:
+        raise NotFoundError("user not found")
+    return CustomORJSONResponse(profile)
+
+
+@router.get(path="",
+            response_model=None,
+            responses={status.HTTP_200_OK: {"model": UserProfilePageSchema}},
             status_code=status.HTTP_200_OK)
+async def get_user_profiles(
+    db: Database,
+    _: AdminAccess,
+    limit: int = settings.DEFAULT_PAGE_SIZE,
+    cursor: str | None = None,
+):
+    profiles, next_cursor = await db.get_user_profiles_page(limit=limit, cursor=cursor)
+    return CustomORJSONResponse({"users": profiles, "next_cursor": next_cursor})
+
+
+@router.get(path="/exists",
+            status_code=status.HTTP_200_OK,
+            dependencies=[Depends(read_your_writes)])
 async def has_user(
     username: str,
     db: Database
@@ -15,4 +54,31 @@ async def has_user(
     user = await db.get_user_by_username(username)
     if user is None:
         raise NotFoundError("user not found")
+
+
+@router.post(path="/import",
+             response_model=UserImportResultSchema,
+             status_code=status.HTTP_201_CREATED)
+async def import_users(
+    users: list[UserImportSchema],
+    db: PrimaryDatabase,
+    _: AdminAccess,
+):
+    if len(users) > settings.USER_IMPORT_MAX_USERS:
+        raise BadRequestError(f"at most {settings.USER_IMPORT_MAX_USERS} users per import")
+
+    # only new usernames (first occurrence) are hashed, add_users still skips the ones created meanwhile
+    existing = await db.get_existing_usernames([user.username for user in users]) if users else set()
+    new_users = {}
+    for user in users:
+        if user.username not in existing:
+            new_users.setdefault(user.username, user)
+    hashed_passwords = await get_password_hashes([user.password for user in new_users.values()])
+    body_users = [UserCreateSchema(username=user.username, hashed_password=hashed)
+                  for user, hashed in zip(new_users.values(), hashed_passwords)]
+    created = set(await db.add_users(body_users)) if body_users else set()
+
+    return UserImportResultSchema(created=len(created),
+                                  skipped=[user.username for user in users if user.username not in created])
+
     
\ No newline at end of file
@@ -0,0 +1,16 @@
+from pydantic import BaseModel
+from datetime import datetime
+
+
+class MessageOutSchema(BaseModel):
+    id: int
+    conversation_id: int
+    role: str | None
+    content: str | None
+    created_at: datetime | None
+
+
+class MessagePageSchema(BaseModel):
+    messages: list[MessageOutSchema]
+    next_cursor: str | None
+
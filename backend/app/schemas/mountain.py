@@ -0,0 +1,20 @@
+from pydantic import BaseModel
+
+
+class MountainOutSchema(BaseModel):
+    id: int
+    name: str | None
+    level: int | None
+    province: str | None
+    city: str | None
+    address: str | None
+    latitude: float | None
+    longitude: float | None
+
+
+class NearbyMountainSchema(MountainOutSchema):
+    distance_km: float
+
+
+class MountainSearchResultSchema(MountainOutSchema):
+    score: float
@@ -0,0 +1,37 @@
+from pydantic import BaseModel
+
+from .mountain import MountainOutSchema
+
+
+class TourStatsSchema(BaseModel):
+    tours: int
+    distance: int
+    up_duration: int
+    down_duration: int
+    avg_difficulty: float | None
+
+
+class UserTourStatsSchema(BaseModel):
+    total: TourStatsSchema
+    months: dict[str, TourStatsSchema]
+
+
+class LeaderboardEntrySchema(TourStatsSchema):
+    rank: int
+    user_id: str
+
+
+class CourseOutSchema(BaseModel):
+    id: int
+    mountain_id: int | None
+    course_name: str | None
+    course_distance: int | None
+    course_duration: int | None
+    course_difficulty: int | None
+
+
+class CourseRecommendationSchema(BaseModel):
+    course: CourseOutSchema
+    mountain: MountainOutSchema
+    distance_km: float
+    score: float
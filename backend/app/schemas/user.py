@@ -7,9 +7,36 @@ class UserCreateSchema(BaseModel):
     hashed_password: str
 
 
+class UserImportSchema(BaseModel):
+    username: EmailStr
+    password: str
+
+
+class UserImportResultSchema(BaseModel):
+    created: int
+    skipped: list[str]
+
+
 class UserOutSchema(BaseModel):
     id: str
     username: str
     authority_level: int
     created_at: datetime
     update_datetime: datetime | None
+
+
+class UserProfileSchema(UserOutSchema):
+    nickname: str | None
+    gender: str | None
+    phone_number: str | None
+    org_name: str | None
+    post_number: str | None
+    city_id: int | None
+    district_id: int | None
+    address: str | None
+    created_at: datetime | None
+
+
+class UserProfilePageSchema(BaseModel):
+    users: list[UserProfileSchema]
+    next_cursor: str | None
@@ -0,0 +1,72 @@
+"""
+access token sign / verify throughput: current HS256 + SECRET_KEY vs. asymmetric keys from JWTKeyRing.
+also checks that decode_access_token serves a repeated kid-less HS256 token (no key files) from
+verified_token_cache.
+
+usage (from the app folder, with the usual env vars set):
+    python test/benchmark/jwt_sign_verify_benchmark.py
+"""
+import sys
+import time
+import asyncio
+import tempfile
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import jwt
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+sys.path.append(Path.cwd().__str__())
+from utils.jwt_key_util import SigningKey, jwt_key_ring
+from utils.auth_util import create_access_token
+from dependencies.endpoint_function_dependency import decode_access_token, verified_token_cache
+
+
+ROUNDS = 5000
+PAYLOAD = {"sub": "3f1c8a52-5a9e-4c55-9d0e-1f0d8b1f9a11", "username": "someone@example.com", "aut": 4,
+           "created_at": "2025-01-01T00:00:00+09:00", "exp": datetime.now(timezone.utc) + timedelta(hours=1)}
+
+
+def ops_per_second(func) -> float:
+    st = time.perf_counter()
+    for _ in range(ROUNDS):
+        func()
+    return ROUNDS / (time.perf_counter() - st)
+
+
+def bench_hs256():
+    secret = "x" * 64
+    token = jwt.encode(PAYLOAD, secret, algorithm="HS256")
+    return (ops_per_second(lambda: jwt.encode(PAYLOAD, secret, algorithm="HS256")),
+            ops_per_second(lambda: jwt.decode(token, secret, algorithms=["HS256"])))
+
+
+def bench_key(key: SigningKey):
+    token = jwt.encode(PAYLOAD, key.private_key, algorithm=key.algorithm, headers={"kid": key.kid})
+    return (ops_per_second(lambda: jwt.encode(PAYLOAD, key.private_key, algorithm=key.algorithm,
+                                              headers={"kid": key.kid})),
+            ops_per_second(lambda: jwt.decode(token, key.public_key, algorithms=[key.algorithm])))
+
+
+async def check_hs256_cache_hit() -> bool:
+    jwt_key_ring.key_dir = tempfile.mkdtemp()
+    await jwt_key_ring.reload(force=True)
+    token = create_access_token({"sub": PAYLOAD["sub"], "aut": PAYLOAD["aut"]})
+    assert "kid" not in jwt.get_unverified_header(token)
+
+    hits = verified_token_cache.hits
+    for _ in range(5):
+        await decode_access_token(token)
+    return verified_token_cache.hits - hits == 4
+
+
+if __name__ == '__main__':
+    print(f"repeated HS256 token cached: {asyncio.run(check_hs256_cache_hit())}")
+    results = {
+        "HS256": bench_hs256(),
+        "EdDSA (Ed25519)": bench_key(SigningKey("ed", Ed25519PrivateKey.generate(), 0)),
+        "ES256 (P-256)": bench_key(SigningKey("es", ec.generate_private_key(ec.SECP256R1()), 0)),
+    }
+    print(f"{'algorithm':<18} {'sign/s':>10} {'verify/s':>10}")
+    for name, (sign, verify) in results.items():
+        print(f"{name:<18} {sign:10.0f} {verify:10.0f}")
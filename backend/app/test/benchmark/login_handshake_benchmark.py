@@ -0,0 +1,57 @@
+"""
+per-login server cpu cost of the two password transport modes.
+
+usage (from the app folder, with the usual env vars set):
+    python test/benchmark/login_handshake_benchmark.py
+"""
+import sys
+import os
+import time
+import base64
+from pathlib import Path
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding as asymmetric_padding
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+sys.path.append(Path.cwd().__str__())
+from utils.auth_util import (RSA_PUBLIC_KEY, HANDSHAKE_INFO, decrypt_password, decrypt_handshake_password,
+                             handshake_key_ring)
+
+
+ROUNDS = 2000
+PLAIN = f"correct-horse-battery-staple:{int(time.time() * 1000)}".encode()
+
+
+def rsa_client_encrypt() -> bytes:
+    public_key = serialization.load_pem_public_key(RSA_PUBLIC_KEY.encode())
+    return base64.b64encode(public_key.encrypt(PLAIN, asymmetric_padding.PKCS1v15()))
+
+
+def handshake_client_encrypt() -> str:
+    server_key = handshake_key_ring.public_key()
+    client_key = X25519PrivateKey.generate()
+    shared_key = client_key.exchange(X25519PublicKey.from_public_bytes(base64.b64decode(server_key["public_key"])))
+    aes_key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=HANDSHAKE_INFO).derive(shared_key)
+    nonce = os.urandom(12)
+    ciphertext = AESGCM(aes_key).encrypt(nonce, PLAIN, str(server_key["kid"]).encode())
+    client_public_key = client_key.public_key().public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+    parts = ["x25519", str(server_key["kid"])] + [base64.b64encode(x).decode() for x in (client_public_key, nonce, ciphertext)]
+    return ".".join(parts)
+
+
+def bench(name, func, payload):
+    assert func(payload) == PLAIN.decode()
+    st = time.process_time()
+    for _ in range(ROUNDS):
+        func(payload)
+    cpu_us = (time.process_time() - st) / ROUNDS * 1e6
+    print(f"{name:<22} {cpu_us:10.1f} us cpu / login")
+    return cpu_us
+
+
+if __name__ == '__main__':
+    rsa = bench("rsa-2048 pkcs1v15", decrypt_password, rsa_client_encrypt())
+    x25519 = bench("x25519 + aes-256-gcm", decrypt_handshake_password, handshake_client_encrypt())
+    print(f"speedup: {rsa / x25519:.1f}x")
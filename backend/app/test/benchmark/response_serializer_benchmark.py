@@ -0,0 +1,86 @@
+"""
+response rendering cost: jsonable_encoder + orjson (the old CustomORJSONResponse.render) vs. the single pass
+orjson serializer in utils.response_util, over list payloads shaped like the api's responses.
+"validated" adds FastAPI's response_model step (pydantic validation + json dump) in front of the old render,
+which is what a trusted endpoint returning CustomORJSONResponse directly skips. "returned plain" is an
+endpoint without a response_model returning the payload itself: FastAPI still runs jsonable_encoder over it
+before the single pass render, so only endpoints returning CustomORJSONResponse get the single pass column.
+"same output" compares the single pass with the response_model output (microseconds included).
+
+usage (from the app folder, with the usual env vars set):
+    python test/benchmark/response_serializer_benchmark.py
+"""
+import sys
+import time
+import orjson
+from datetime import datetime, timedelta
+from pathlib import Path
+from uuid import uuid4
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+sys.path.append(Path.cwd().__str__())
+from config import settings
+from custom_types import Gender, UserProfile
+from schemas.conversation import MessageOutSchema
+from schemas.mountain import NearbyMountainSchema
+from schemas.user import UserProfileSchema
+from utils.response_util import dumps
+
+
+ROUNDS = 50
+ROWS = 1000
+NOW = datetime.now(settings.CONST.TIMEZONE)
+
+
+def old_render(content) -> bytes:
+    return orjson.dumps(jsonable_encoder(content), option=orjson.OPT_NON_STR_KEYS | orjson.OPT_OMIT_MICROSECONDS)
+
+
+def profiles() -> list[UserProfile]:
+    return [UserProfile(id=str(uuid4()), username=f"user{i}@example.com", authority_level=4,
+                        nickname=f"nick{i}", gender=Gender.Other, phone_number="090-0000-0000", org_name=None,
+                        post_number="100-0001", city_id=13, district_id=i % 23, address="Chiyoda, Tokyo",
+                        created_at=NOW - timedelta(days=i), update_datetime=None)
+            for i in range(ROWS)]
+
+
+def mountains() -> list[dict]:
+    # the nearby / search shape: a record dict plus a computed float
+    return [{"id": i, "name": f"mountain {i}", "level": i % 5, "province": "Nagano", "city": "Matsumoto",
+             "address": None, "latitude": 36.0 + i / 1e4, "longitude": 137.6 + i / 1e4, "distance_km": i / 7}
+            for i in range(ROWS)]
+
+
+def messages() -> list[MessageOutSchema]:
+    return [MessageOutSchema(id=i, conversation_id=1, role="user" if i % 2 else "assistant",
+                             content="how long does the ridge trail take? " * 4, created_at=NOW)
+            for i in range(ROWS)]
+
+
+def ms_per_call(func) -> float:
+    st = time.perf_counter()
+    for _ in range(ROUNDS):
+        func()
+    return (time.perf_counter() - st) / ROUNDS * 1000
+
+
+if __name__ == '__main__':
+    payloads = {
+        "user profiles (slots dataclass)": (profiles(), TypeAdapter(list[UserProfileSchema])),
+        "mountains (dict)": (mountains(), TypeAdapter(list[NearbyMountainSchema])),
+        "messages (pydantic model)": (messages(), TypeAdapter(list[MessageOutSchema])),
+    }
+    print(f"{ROWS} rows per payload, ms per response")
+    print(f"{'payload':<34} {'validated+old':>14} {'old render':>11} {'returned plain':>15} {'single pass':>12} "
+          f"{'same output':>12}")
+    for name, (payload, adapter) in payloads.items():
+        def validated_render():
+            return old_render(adapter.dump_python(adapter.validate_python(payload, from_attributes=True), mode="json"))
+
+        validated = ms_per_call(validated_render)
+        old = ms_per_call(lambda: old_render(payload))
+        plain = ms_per_call(lambda: dumps(jsonable_encoder(payload)))
+        new = ms_per_call(lambda: dumps(payload))
+        same = orjson.loads(validated_render()) == orjson.loads(dumps(payload))
+        print(f"{name:<34} {validated:14.2f} {old:11.2f} {plain:15.2f} {new:12.2f} {str(same):>12}")
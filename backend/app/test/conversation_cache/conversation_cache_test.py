@@ -0,0 +1,107 @@
+"""
+conversation tail cache against a local postgres: after every step the tail served by
+conversation_tail_cache must equal Session.get_latest_messages, and the steps that should keep the cached
+tail (appends through the cache, including this worker's own NOTIFY coming back) must not reload it.
+
+steps: first read, appends through the cache, a message written by "another worker" (a plain Session,
+the cache only learns about it from the NOTIFY) and an edited message.
+
+the schema is migrated first (utils.schema_util). the seeded rows are deleted again at the end.
+
+usage (from the app folder, DB_URL pointing at a local postgres, the other env vars as usual):
+    python test/conversation_cache/conversation_cache_test.py
+"""
+import sys
+import asyncio
+from pathlib import Path
+from sqlalchemy import text
+
+sys.path.append(Path.cwd().__str__())
+from database import engine
+from utils.crud_util import Session
+from utils.schema_util import migrate
+from utils.notify_util import pg_listener
+from utils.conversation_util import conversation_tail_cache, to_record
+
+
+USER_ID = "cc-user-1"
+CONVERSATION_ID = 910_001
+HISTORY = 80
+APPENDS = 10
+# NOTIFY delivery
+SETTLE_SECONDS = 0.5
+
+SEED_SQL = [
+    f"INSERT INTO t_user (id, username, authority_level) VALUES ('{USER_ID}', '{USER_ID}@example.com', 4)",
+    f"INSERT INTO t_conversation (id, user_id) VALUES ({CONVERSATION_ID}, '{USER_ID}')",
+    f"""INSERT INTO t_message (conversation_id, role, content)
+        SELECT {CONVERSATION_ID}, CASE WHEN g % 2 = 0 THEN 'user' ELSE 'assistant' END, 'cc-message-' || g
+        FROM generate_series(1, {HISTORY}) g""",
+]
+
+CLEANUP_SQL = [
+    f"DELETE FROM t_message WHERE conversation_id = {CONVERSATION_ID}",
+    f"DELETE FROM t_conversation WHERE id = {CONVERSATION_ID}",
+    f"DELETE FROM t_user WHERE id = '{USER_ID}'",
+]
+
+
+async def run_sql(statements: list[str]) -> None:
+    async with engine.begin() as conn:
+        for sql in statements:
+            await conn.execute(text(sql))
+
+
+async def check(step: str, cached: bool) -> bool:
+    """
+    cached: whether the tail must still be in the cache (True) or must have been dropped (False) by now
+    """
+    await asyncio.sleep(SETTLE_SECONDS)
+    in_cache = CONVERSATION_ID in conversation_tail_cache.cache
+    async with Session(use_primary=True) as db:
+        want = [to_record(message)
+                for message in await db.get_latest_messages(CONVERSATION_ID, conversation_tail_cache.tail_size)]
+    got = await conversation_tail_cache.get_tail(CONVERSATION_ID)
+
+    ok = got == want and in_cache == cached
+    print(f"{step:<22} tail={len(got):<4} cached={str(in_cache):<6} {'OK' if ok else 'MISMATCH'}")
+    if got != want:
+        print(f"    expected ids {[m.id for m in want][-5:]} got {[m.id for m in got][-5:]}")
+    return ok
+
+
+async def main() -> bool:
+    await migrate()
+    await run_sql(CLEANUP_SQL + SEED_SQL)
+    pg_listener.start()
+    try:
+        while not pg_listener.listening:
+            await asyncio.sleep(0.1)
+
+        ok = await check("first read", cached=False)
+
+        for i in range(APPENDS):
+            await conversation_tail_cache.add_message(CONVERSATION_ID, "user", f"cc-append-{i}")
+        ok = await check("appends (own NOTIFY)", cached=True) and ok
+
+        # two appends racing on one conversation
+        await asyncio.gather(*(conversation_tail_cache.add_message(CONVERSATION_ID, "assistant", f"cc-race-{i}")
+                               for i in range(2)))
+        ok = await check("concurrent appends", cached=True) and ok
+
+        async with Session(use_primary=True) as db:
+            await db.add_message(CONVERSATION_ID, "user", "cc-other-worker")
+        ok = await check("other worker's insert", cached=False) and ok
+
+        await run_sql([f"""UPDATE t_message SET content = 'cc-edited' WHERE id = (
+                               SELECT max(id) FROM t_message WHERE conversation_id = {CONVERSATION_ID})"""])
+        ok = await check("edited message", cached=False) and ok
+        return ok
+    finally:
+        await pg_listener.stop()
+        await run_sql(CLEANUP_SQL)
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    sys.exit(0 if asyncio.run(main()) else 1)
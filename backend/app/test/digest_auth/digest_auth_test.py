@@ -0,0 +1,111 @@
+"""
+digest auth against a local postgres: a small app with one endpoint behind authenticate_digest, called
+through httpx (qop auth) and with hand built auth-int headers.
+
+checks: a valid response passes, a replayed or lower nc and a wrong password get 401, concurrent copies of
+one request (same nonce and nc) pass once, the auth-int endpoint still reads the body after it was hashed,
+and delete_expired_digest_nonces drops the used nonces once they expire.
+
+the schema is migrated first (utils.schema_util). the nonces written here are deleted again at the end.
+
+usage (from the app folder, DB_URL pointing at a local postgres, the other env vars as usual):
+    python test/digest_auth/digest_auth_test.py
+"""
+import sys
+import asyncio
+import hashlib
+from pathlib import Path
+import httpx
+from fastapi import FastAPI, Request, Depends
+from sqlalchemy import text
+
+sys.path.append(Path.cwd().__str__())
+from database import engine
+from config import settings
+from utils import authenticate_digest
+from utils.crud_util import Session
+from utils.schema_util import migrate
+from utils.auth_util import DigestAuth
+
+
+USER = "admin"
+URL = "http://digest.test/echo"
+
+app = FastAPI()
+
+
+@app.post("/echo", dependencies=[Depends(authenticate_digest)])
+async def echo(request: Request):
+    return {"body": (await request.body()).decode()}
+
+
+def md5(*parts: str) -> str:
+    return hashlib.md5(":".join(parts).encode()).hexdigest()
+
+
+async def get_challenge(client: httpx.AsyncClient) -> dict:
+    response = await client.post(URL)
+    assert response.status_code == 401
+    header = response.headers["www-authenticate"]
+    return DigestAuth(None).parse_auth_header(header.removeprefix("Digest "))
+
+
+def auth_header(challenge: dict, nc: int, body: bytes, password: str = None, qop: str = "auth-int") -> str:
+    cnonce, nc_value = "0a4f113b", f"{nc:08x}"
+    ha1 = md5(USER, challenge["realm"], password or settings.HTTP_DIGEST_AUTH_PASSWORD)
+    ha2 = md5("POST", "/echo", hashlib.md5(body).hexdigest()) if qop == "auth-int" else md5("POST", "/echo")
+    response = md5(ha1, challenge["nonce"], nc_value, cnonce, qop, ha2)
+    return (f'Digest username="{USER}", realm="{challenge["realm"]}", nonce="{challenge["nonce"]}", uri="/echo", '
+            f'qop={qop}, nc={nc_value}, cnonce="{cnonce}", response="{response}", opaque="{challenge["opaque"]}"')
+
+
+async def post(client: httpx.AsyncClient, challenge: dict, nc: int, body: bytes = b"", **kwargs) -> httpx.Response:
+    return await client.post(URL, content=body,
+                             headers={"Authorization": auth_header(challenge, nc, body, **kwargs)})
+
+
+def report(step: str, ok: bool) -> bool:
+    print(f"{step:<34} {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+async def main() -> bool:
+    await migrate()
+    nonces = []
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport) as client:
+            response = await client.post(URL, content=b"x", auth=httpx.DigestAuth(USER, settings.HTTP_DIGEST_AUTH_PASSWORD))
+            ok = report("httpx digest (qop auth)", response.status_code == 200)
+
+            challenge = await get_challenge(client)
+            nonces.append(challenge["nonce"])
+            body = b'{"payload": "' + b"x" * 100_000 + b'"}'
+            response = await post(client, challenge, 1, body)
+            ok = report("auth-int, endpoint reads body",
+                        response.status_code == 200 and response.json()["body"] == body.decode()) and ok
+            ok = report("same nc replayed", (await post(client, challenge, 1, body)).status_code == 401) and ok
+            ok = report("next nc", (await post(client, challenge, 2, qop="auth")).status_code == 200) and ok
+            ok = report("lower nc", (await post(client, challenge, 1, qop="auth")).status_code == 401) and ok
+            ok = report("wrong password", (await post(client, challenge, 3, password="wrong")).status_code == 401) and ok
+
+            # the wrong password burnt nc 3
+            responses = await asyncio.gather(*(post(client, challenge, 4, b"race") for _ in range(8)))
+            ok = report("concurrent copies of one request",
+                        sorted(r.status_code for r in responses) == [200] + [401] * 7) and ok
+
+        async with engine.begin() as conn:
+            await conn.execute(text("UPDATE t_digest_nonce SET expires_at = now() - interval '1 second' "
+                                    "WHERE nonce = ANY(:nonces)"), {"nonces": nonces})
+        async with Session(use_primary=True) as db:
+            deleted = await db.delete_expired_digest_nonces()
+        ok = report("expired nonces purged", deleted >= len(nonces)) and ok
+        return ok
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text("DELETE FROM t_digest_nonce WHERE nonce = ANY(:nonces)"), {"nonces": nonces})
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    sys.exit(0 if asyncio.run(main()) else 1)
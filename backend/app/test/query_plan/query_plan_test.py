@@ -0,0 +1,121 @@
+"""
+query plan regression: EXPLAIN the hot repository queries against a seeded local postgres and fail
+when one of them falls back to a sequential scan of the table it looks up.
+
+the schema is migrated first (utils.schema_util). seeding, ANALYZE and EXPLAIN run in a single transaction
+that is rolled back at the end, so the database is left as it was.
+
+usage (from the app folder, DB_URL pointing at a local postgres, the other env vars as usual):
+    python test/query_plan/query_plan_test.py
+"""
+import sys
+import asyncio
+import orjson
+from pathlib import Path
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql
+
+sys.path.append(Path.cwd().__str__())
+from database import engine, User, RevokedToken, Tour, TourCourse, Conversation, Message, Quota
+from utils.crud_util import Session
+from utils.schema_util import migrate
+
+
+USERS = 5000
+MOUNTAINS = 1000
+COURSES = 10000
+TOURS = 100000
+CONVERSATIONS = 20000
+MESSAGES = 400000
+REVOKED_TOKENS = 50000
+
+SEED_SQL = [
+    f"""INSERT INTO t_user (id, username, authority_level)
+        SELECT 'qp-user-' || g, 'qp-user-' || g || '@example.com', 4 FROM generate_series(1, {USERS}) g""",
+    f"""INSERT INTO t_mountain (name, level, latitude, longitude)
+        SELECT 'qp-mountain-' || g, g % 5, 30 + random() * 15, 128 + random() * 17
+        FROM generate_series(1, {MOUNTAINS}) g""",
+    f"""INSERT INTO t_tour_course (mountain_id, course_name, course_distance, course_duration, course_difficulty)
+        SELECT g % {MOUNTAINS}, 'qp-course-' || g, g % 20000, g % 600, g % 5 FROM generate_series(1, {COURSES}) g""",
+    f"""INSERT INTO t_tour (name, user_id, tour_date, mountain_id, tour_distance)
+        SELECT 'qp-tour-' || g, 'qp-user-' || (g % {USERS} + 1), now() - g * interval '1 hour', g % {MOUNTAINS},
+               g % 20000
+        FROM generate_series(1, {TOURS}) g""",
+    f"""INSERT INTO t_conversation (user_id, closed)
+        SELECT 'qp-user-' || (g % {USERS} + 1), false FROM generate_series(1, {CONVERSATIONS}) g""",
+    f"""INSERT INTO t_message (content, role, conversation_id)
+        SELECT 'qp-message-' || g, 'user', g % {CONVERSATIONS} FROM generate_series(1, {MESSAGES}) g""",
+    f"""INSERT INTO t_quota (user_id, total_quota, used_quota)
+        SELECT 'qp-user-' || g, 100, 0 FROM generate_series(1, {USERS}) g""",
+    f"""INSERT INTO t_revoked_token (token_id, expires_at)
+        SELECT md5('qp-' || g), now() + interval '7 days' FROM generate_series(1, {REVOKED_TOKENS}) g""",
+    "ANALYZE",
+]
+
+
+def hot_queries() -> list[tuple[str, str, object]]:
+    """
+    Returns: [(name, table that must not be seq scanned, stmt with its parameters bound)]
+    """
+    def bound(stmt_params):
+        stmt, params = stmt_params
+        return stmt.params(**params)
+
+    page_params = {"p_limit": 51, "c_value": 1000, "c_pk": 1000}
+    return [
+        ("user by username", "t_user", bound(Session._get_stmt(User, {"username": "qp-user-42@example.com"}))),
+        ("user by id", "t_user", bound(Session._get_stmt(User, {"id": "qp-user-42"}))),
+        ("revoked token ids", "t_revoked_token",
+         select(RevokedToken.token_id).where(RevokedToken.token_id.in_(["a" * 32, "b" * 32]))),
+        ("tours of a user by date", "t_tour",
+         bound(Session._get_page_stmt(Tour, {"user_id": "qp-user-42"}, ("tour_date", "desc"))).params(p_limit=51)),
+        ("tours on a mountain", "t_tour", bound(Session._get_stmt(Tour, {"mountain_id": 42}, None, "all"))),
+        ("courses of a mountain", "t_tour_course",
+         bound(Session._get_stmt(TourCourse, {"mountain_id": 42}, None, "all"))),
+        ("conversations of a user", "t_conversation",
+         bound(Session._get_stmt(Conversation, {"user_id": "qp-user-42"}, ("id", "desc"), "all"))),
+        ("latest messages of a conversation", "t_message",
+         bound(Session._get_page_stmt(Message, {"conversation_id": 42}, ("id", "desc"))).params(p_limit=51)),
+        ("messages of a conversation, next page", "t_message",
+         bound(Session._get_page_stmt(Message, {"conversation_id": 42}, ("id", "desc"), after_cursor=True))
+         .params(**page_params)),
+        ("quota of a user", "t_quota", bound(Session._get_stmt(Quota, {"user_id": "qp-user-42"}))),
+    ]
+
+
+def seq_scans(plan: dict) -> list[str]:
+    found = [plan["Relation Name"]] if plan.get("Node Type") == "Seq Scan" else []
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+async def main() -> int:
+    await migrate()
+    dialect = postgresql.dialect()
+    failures = 0
+    async with engine.connect() as conn:
+        trans = await conn.begin()
+        try:
+            for sql in SEED_SQL:
+                await conn.execute(text(sql))
+
+            for name, table, stmt in hot_queries():
+                sql = str(stmt.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+                raw = await conn.scalar(text(f"EXPLAIN (FORMAT JSON) {sql}"))
+                plan = (orjson.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+                ok = table not in seq_scans(plan)
+                failures += not ok
+                print(f"{'ok  ' if ok else 'FAIL'} {name:<40} {plan['Node Type']} (cost {plan['Total Cost']})")
+                if not ok:
+                    print(f"     {sql}")
+        finally:
+            await trans.rollback()
+    await engine.dispose()
+
+    print(f"{failures} query plan regression(s)")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,120 @@
+"""
+tour statistics against a local postgres: the full rebuild (streamed from t_tour) and the incremental updates
+driven by the t_tour NOTIFY trigger must both match a GROUP BY over the table.
+
+the schema is migrated first (utils.schema_util). the seeded rows are committed (the aggregate reads them
+through its own sessions) and deleted again at the end.
+
+usage (from the app folder, DB_URL pointing at a local postgres, the other env vars as usual):
+    python test/tour_stats/tour_stats_test.py
+"""
+import sys
+import asyncio
+from pathlib import Path
+from sqlalchemy import text
+
+sys.path.append(Path.cwd().__str__())
+from config import settings
+from database import engine
+from utils.schema_util import migrate
+from utils.notify_util import pg_listener
+from utils.tour_stats_util import tour_stats, STAT_FIELDS
+
+
+USERS = 50
+TOURS = 20000
+PREFIX = "ts-user-"
+
+SEED_SQL = [
+    f"""INSERT INTO t_user (id, username, authority_level)
+        SELECT '{PREFIX}' || g, '{PREFIX}' || g || '@example.com', 4 FROM generate_series(1, {USERS}) g""",
+    f"""INSERT INTO t_tour (name, user_id, tour_date, mountain_id, tour_distance, tour_up_duration,
+                           tour_down_duration, tour_difficulty)
+        SELECT 'ts-tour-' || g, '{PREFIX}' || (g % {USERS} + 1), now() - g * interval '7 hours',
+               CASE WHEN g % 11 = 0 THEN NULL ELSE g % 40 END, g % 20000, g % 300, g % 200,
+               CASE WHEN g % 13 = 0 THEN NULL ELSE g % 5 + 1 END
+        FROM generate_series(1, {TOURS}) g""",
+]
+
+CHANGE_SQL = [
+    f"""UPDATE t_tour SET tour_distance = tour_distance + 1000, mountain_id = 99, tour_date = tour_date - interval '40 days'
+        WHERE user_id LIKE '{PREFIX}%' AND id % 97 = 0""",
+    f"DELETE FROM t_tour WHERE user_id LIKE '{PREFIX}%' AND id % 89 = 0",
+    f"""INSERT INTO t_tour (name, user_id, tour_date, mountain_id, tour_distance, tour_difficulty)
+        SELECT 'ts-new-' || g, '{PREFIX}' || (g % {USERS} + 1), now(), 7, 500, 3 FROM generate_series(1, 300) g""",
+]
+
+CLEANUP_SQL = [f"DELETE FROM t_user WHERE id LIKE '{PREFIX}%'"]
+
+GROUP_SQL = """
+    SELECT user_id, {key} AS key, count(*), coalesce(sum(tour_distance), 0), coalesce(sum(tour_up_duration), 0),
+           coalesce(sum(tour_down_duration), 0), coalesce(sum(tour_difficulty), 0)
+    FROM t_tour WHERE user_id LIKE :prefix AND {key} IS NOT NULL GROUP BY 1, 2
+"""
+
+
+async def run_sql(statements: list[str]) -> None:
+    async with engine.begin() as conn:
+        for sql in statements:
+            await conn.execute(text(sql))
+
+
+async def expected() -> dict:
+    month = f"to_char(tour_date AT TIME ZONE '{settings.CONST.TINEZONE_STR}', 'YYYY-MM')"
+    groups = {}
+    async with engine.connect() as conn:
+        for kind, key in (("all", "'all'"), ("month", month), ("mountain", "mountain_id")):
+            result = await conn.execute(text(GROUP_SQL.format(key=key)), {"prefix": f"{PREFIX}%"})
+            for user_id, value, *values in result:
+                groups[(kind, None if kind == "all" else value, user_id)] = tuple(values)
+    return groups
+
+
+def actual() -> dict:
+    def values(stats):
+        return tuple(getattr(stats, field) for field in STAT_FIELDS)
+
+    groups = {("all", None, user_id): values(stats)
+              for user_id, stats in tour_stats.user_totals.items() if user_id.startswith(PREFIX)}
+    for (kind, key), bucket in tour_stats.buckets.items():
+        for user_id, stats in bucket.items():
+            if user_id.startswith(PREFIX):
+                groups[(kind, key, user_id)] = values(stats)
+    return groups
+
+
+async def check(step: str) -> bool:
+    want, got = await expected(), actual()
+    ok = want == got
+    print(f"{step:<12} groups={len(want):<6} {'OK' if ok else 'MISMATCH'}")
+    for key in sorted(want.keys() ^ got.keys() | {k for k in want.keys() & got.keys() if want[k] != got[k]},
+                      key=str)[:5]:
+        print(f"    {key}: expected {want.get(key)} got {got.get(key)}")
+    return ok
+
+
+async def main() -> bool:
+    await migrate()
+    await run_sql(CLEANUP_SQL + SEED_SQL)
+    try:
+        await tour_stats.reload()
+        ok = await check("rebuild")
+
+        pg_listener.start()
+        while not pg_listener.listening:
+            await asyncio.sleep(0.1)
+        await run_sql(CHANGE_SQL)
+        # NOTIFY delivery + the debounced refresh
+        await asyncio.sleep(tour_stats.DEBOUNCE_SECONDS * 4)
+        while tour_stats._refresh_task is not None:
+            await asyncio.sleep(0.1)
+        ok = await check("incremental") and ok
+        return ok
+    finally:
+        await pg_listener.stop()
+        await run_sql(CLEANUP_SQL)
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    sys.exit(0 if asyncio.run(main()) else 1)
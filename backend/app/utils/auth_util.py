@@ -6,25 +6,44 @@ from datetime import timedelta, datetime, timezone
 import os
 import re
 import time
+import random
 import binascii
 import base64
 import hashlib
+import hmac
+import asyncio
+from uuid import uuid4
 import jwt
 import jwt.algorithms
 from passlib.context import CryptContext
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric import padding as asymmetric_padding
 from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.exceptions import InvalidTag
 
 from utils.crud_util import Session
 from utils.logger_util import logger
-from exceptions import DigestAuthError
+from utils.executor_util import BoundedExecutor
+from utils.jwt_key_util import jwt_key_ring
+from exceptions import DigestAuthError, BadRequestError, ServiceUnavailableError
 from database import User
 from config import settings
 from custom_types import CurrentUser
 
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt blocks for hundreds of ms, keep it off the event loop and reject fast when overloaded
+password_hash_executor = BoundedExecutor("password_hash",
+                                         max_workers=settings.PASSWORD_HASH_WORKERS,
+                                         max_queue=settings.PASSWORD_HASH_QUEUE_LIMIT)
+# bulk user import gets its own pool so it never queues in front of interactive logins
+bulk_hash_executor = BoundedExecutor("password_import", max_workers=os.cpu_count() or 1, max_queue=os.cpu_count() or 1)
+# imports (also several at once) never have more hashes in flight than the pool has workers, so they wait here
+# instead of hitting the executor's queue limit with a 503 halfway through a batch
+bulk_hash_slots = asyncio.Semaphore(bulk_hash_executor.max_workers)
 SECRET_KEY = settings.SECRET_KEY
 REFRESH_SECRET_KEY = settings.REFRESH_SECRET_KEY
 ALGORITHM = settings.ALGORITHM
@@ -57,25 +76,190 @@ def decrypt_password(encrypted_password: str) -> str:
 # endregion
 
 
+# region x25519 handshake
+# the login form password is "x25519.<kid>.<client public key>.<nonce>.<ciphertext>" (base64 parts).
+# the client does an X25519 exchange with the server key of <kid>, derives an AES-256-GCM key with
+# HKDF-SHA256(info=HANDSHAKE_INFO) and encrypts "password:timestamp" (unix ms) with <kid> as associated data.
+HANDSHAKE_PREFIX = "x25519."
+HANDSHAKE_INFO = b"climbclub-login-handshake"
+
+
+class HandshakeKeyRing:
+    """
+    X25519 server keys that rotate every rotate_seconds.
+
+    each key is derived from HANDSHAKE_SECRET_KEY and its kid (the rotation epoch), so every worker serves the same key
+    without sharing state, and the previous key is still accepted for logins started just before a rotation.
+    """
+    def __init__(self, secret: bytes, rotate_seconds: int):
+        self.secret = secret
+        self.rotate_seconds = rotate_seconds
+        self._keys: dict[int, X25519PrivateKey] = {}
+
+    def current_kid(self) -> int:
+        return int(time.time() // self.rotate_seconds)
+
+    def get_private_key(self, kid: int) -> X25519PrivateKey | None:
+        current_kid = self.current_kid()
+        if kid not in (current_kid, current_kid - 1):
+            return None
+
+        private_key = self._keys.get(kid)
+        if private_key is None:
+            seed = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                        info=HANDSHAKE_INFO + b"-key:" + self.int_to_bytes(kid)).derive(self.secret)
+            private_key = X25519PrivateKey.from_private_bytes(seed)
+            self._keys = {k: v for k, v in self._keys.items() if k >= current_kid - 1}
+            self._keys[kid] = private_key
+        return private_key
+
+    def public_key(self) -> dict:
+        kid = self.current_kid()
+        public_bytes = self.get_private_key(kid).public_key().public_bytes(serialization.Encoding.Raw,
+                                                                           serialization.PublicFormat.Raw)
+        return {"kid": kid,
+                "public_key": base64.b64encode(public_bytes).decode("ascii"),
+                "expires_at": (kid + 1) * self.rotate_seconds}
+
+    @staticmethod
+    def int_to_bytes(i):
+        return ('%d' % i).encode('ascii')
+
+
+handshake_key_ring = HandshakeKeyRing(settings.HANDSHAKE_SECRET_KEY.encode("utf-8"),
+                                      rotate_seconds=settings.HANDSHAKE_KEY_ROTATE_MINUTES * 60)
+
+
+def decrypt_handshake_password(encrypted_password: str) -> str:
+    try:
+        _, kid, client_public_key, nonce, ciphertext = encrypted_password.split(".")
+        private_key = handshake_key_ring.get_private_key(int(kid))
+        if private_key is None:
+            raise BadRequestError("handshake key expired, fetch a new one")
+
+        shared_key = private_key.exchange(X25519PublicKey.from_public_bytes(base64.b64decode(client_public_key)))
+        aes_key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=HANDSHAKE_INFO).derive(shared_key)
+        decrypted = AESGCM(aes_key).decrypt(base64.b64decode(nonce), base64.b64decode(ciphertext),
+                                            kid.encode("ascii")).decode()
+        timestamp = int(decrypted.rpartition(":")[2])
+    except (ValueError, binascii.Error, InvalidTag):
+        # UnicodeDecodeError is a ValueError too
+        raise BadRequestError("invalid encrypted password")
+
+    # the key is valid for up to two rotations, the timestamp bounds how long a captured form can be replayed
+    if abs(time.time() * 1000 - timestamp) > settings.HANDSHAKE_MAX_AGE_SECONDS * 1000:
+        raise BadRequestError("login request expired, encrypt the password again")
+    return decrypted
+# endregion
+
+
+# region bcrypt cost
+# rounds in use, filled by calibrate_bcrypt_rounds() at startup
+bcrypt_policy = {"rounds": None, "measured_ms": None, "target_ms": settings.BCRYPT_TARGET_MS}
+_rehash_tasks: set[asyncio.Task] = set()
+# any constant works, it only has to be the same for every worker
+BCRYPT_CALIBRATION_LOCK_ID = 7_262_007
+
+
+def measure_bcrypt_rounds() -> tuple[int, float]:
+    """
+    Returns: (highest bcrypt cost whose hash time stays under BCRYPT_TARGET_MS on this hardware, its time in ms)
+    """
+    min_rounds, max_rounds = settings.BCRYPT_MIN_ROUNDS, settings.BCRYPT_MAX_ROUNDS
+    probe_context = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=min_rounds)
+
+    # best of 3 to filter out scheduler noise; every extra round doubles the cost
+    samples = []
+    for _ in range(3):
+        st = time.perf_counter()
+        probe_context.hash(base64.b64encode(os.urandom(12)).decode("ascii"))
+        samples.append((time.perf_counter() - st) * 1000)
+    base_ms = min(samples)
+
+    rounds = min_rounds
+    while rounds < max_rounds and base_ms * 2 ** (rounds + 1 - min_rounds) <= settings.BCRYPT_TARGET_MS:
+        rounds += 1
+    return rounds, round(base_ms * 2 ** (rounds - min_rounds), 1)
+
+
+async def calibrate_bcrypt_rounds() -> int:
+    """
+    one bcrypt cost for every worker: BCRYPT_ROUNDS when pinned, otherwise measured by the first worker that
+    starts (the others wait on an advisory lock) and kept in t_app_setting until BCRYPT_TARGET_MS changes.
+    delete the "bcrypt_policy" row to measure again after a hardware change.
+
+    the cost only raises the floor (min_rounds): needs_update() flags hashes below it, while hashes made with
+    a higher cost stay valid, so a worker still running an older policy can't make logins flip between costs.
+    """
+    if settings.BCRYPT_ROUNDS:
+        policy = {"rounds": settings.BCRYPT_ROUNDS, "measured_ms": None, "target_ms": settings.BCRYPT_TARGET_MS}
+    else:
+        async with Session(use_primary=True) as db:
+            await db.advisory_xact_lock(BCRYPT_CALIBRATION_LOCK_ID)
+            policy = await db.get_app_setting("bcrypt_policy")
+            if policy is None or policy.get("target_ms") != settings.BCRYPT_TARGET_MS:
+                rounds, measured_ms = await password_hash_executor.run(measure_bcrypt_rounds)
+                policy = {"rounds": rounds, "measured_ms": measured_ms, "target_ms": settings.BCRYPT_TARGET_MS}
+                await db.set_app_setting("bcrypt_policy", policy)
+
+    rounds = policy["rounds"]
+    pwd_context.update(bcrypt__default_rounds=rounds, bcrypt__min_rounds=rounds)
+    bcrypt_policy.update(policy)
+    logger.info({"bcrypt_policy": bcrypt_policy}, extra="calibrate_bcrypt_rounds")
+    return rounds
+
+
+async def rehash_password(user_id: str, password: str, old_hash: str) -> None:
+    try:
+        new_hash = await get_password_hash(password)
+    except ServiceUnavailableError:
+        # busy with logins, it will be retried on the next login
+        return
+
+    async with Session(use_primary=True) as db:
+        await db.update_user_password_hash(user_id, old_hash, new_hash)
+    logger.info({"user_id": user_id, "rounds": bcrypt_policy["rounds"]}, extra="rehash_password")
+# endregion
+
+
 # region login auth
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await password_hash_executor.run(pwd_context.verify, plain_password, hashed_password)
+
+
+async def get_password_hash(password: str) -> str:
+    return await password_hash_executor.run(pwd_context.hash, password)
 
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+async def get_password_hashes(passwords: list[str]) -> list[str]:
+    # same cost as a signup, spread over the import pool
+    async def hash_password(password: str) -> str:
+        async with bulk_hash_slots:
+            return await bulk_hash_executor.run(pwd_context.hash, password)
+
+    return await asyncio.gather(*(hash_password(password) for password in passwords))
 
 
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
     to_encode.update({"exp": datetime.now(timezone.utc) + ACCESS_TOKEN_EXP})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+    # asymmetric keys let other services verify locally via the jwks endpoint
+    signing_key = jwt_key_ring.signing_key()
+    if signing_key is None:
+        return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+    encoded_jwt = jwt.encode(to_encode, signing_key.private_key, algorithm=signing_key.algorithm,
+                             headers={"kid": signing_key.kid})
     return encoded_jwt
 
 
-def create_refresh_token(data: dict) -> str:
+def create_refresh_token(data: dict, family_id: str | None = None, generation: int = 0) -> str:
+    # rotated tokens keep the family id of the login they came from, each generation can be rotated once
     to_encode = data.copy()
-    to_encode.update({"exp": datetime.now(timezone.utc) + REFRESH_TOKEN_EXP})
+    to_encode.update({"exp": datetime.now(timezone.utc) + REFRESH_TOKEN_EXP,
+                      "fam": family_id or uuid4().hex,
+                      "gen": generation})
     encoded_jwt = jwt.encode(to_encode, REFRESH_SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -86,8 +270,14 @@ async def authenticate_user(username: str, password: str) -> User | None:
         if user is None:
             return None
     
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password(password, user.hashed_password):
         return None
+
+    # upgrade hashes made with an outdated cost without making this login wait for it
+    if pwd_context.needs_update(user.hashed_password):
+        task = asyncio.create_task(rehash_password(user.id, password, user.hashed_password))
+        _rehash_tasks.add(task)
+        task.add_done_callback(_rehash_tasks.discard)
     return user
 # endregion
 
@@ -112,6 +302,10 @@ async def authenticate_digest(request: Request):
 class DigestAuth(object):
     DIGEST_PRIVATE_KEY = b'secret-random'
     DIGEST_CHALLENGE_TIMEOUT_SECONDS = 60
+    # share of requests that also drop the expired nonces from t_digest_nonce
+    NONCE_PURGE_RATE = 0.01
+    # nc is 8 hex digits (rfc 7616)
+    MAX_NC = 0xFFFFFFFF
 
     class SendChallenge(Exception):
         pass
@@ -146,18 +340,29 @@ class DigestAuth(object):
         params = self.parse_auth_header(auth_header)
         try:
             self.verify_params(params)
-            self.verify_opaque(params['opaque'], params['nonce'], self.request.client.host)
+            received_time, nc = self.verify_nonce(params, self.request.client.host)
         except DigestAuthError:
             raise self.SendChallenge()
         challenge = check_credentials_func(params['username'])
         if not challenge:
             raise self.SendChallenge()
 
-        received_response = params['response']
+        # the nc is taken before the auth-int body hash is awaited, so a concurrent copy of this request (on any
+        # worker) finds it used. a forged response burns it too, which needs this client's nonce and address
+        expires_at = datetime.fromtimestamp(received_time + self.DIGEST_CHALLENGE_TIMEOUT_SECONDS, timezone.utc)
+        async with Session(use_primary=True) as db:
+            reserved = await db.reserve_digest_nc(params['nonce'], nc, expires_at)
+        if not reserved:
+            raise self.SendChallenge()
+        if random.random() < self.NONCE_PURGE_RATE:
+            async with Session(use_primary=True) as db:
+                await db.delete_expired_digest_nonces()
+
+        received_response = params.get('response')
         expected_response = await self.calculate_expected_response(challenge, params)
 
         if expected_response and received_response:
-            if expected_response == received_response:
+            if hmac.compare_digest(expected_response, received_response):
                 logger.info({'current_user': params['username']}, extra={"api_call": "digest_auth"})
                 return True
             else:
@@ -178,7 +383,7 @@ class DigestAuth(object):
         opaque = self.create_opaque(nonce, clientip, time_)
         realm = realm.replace('\\', '\\\\').replace('"', '\\"')
 
-        hdr = 'Digest algorithm="MD5", realm="%s", qop="auth", nonce="%s", opaque="%s"'
+        hdr = 'Digest algorithm="MD5", realm="%s", qop="auth,auth-int", nonce="%s", opaque="%s"'
         return hdr % (realm, nonce.decode('ascii'), opaque.decode('ascii'))
 
     def create_opaque(self, nonce, clientip, now):
@@ -216,6 +421,25 @@ class DigestAuth(object):
         if 'nonce' not in params:
             raise DigestAuthError('Invalid response, no nonce given')
 
+    def verify_nonce(self, params, clientip) -> tuple[int, int]:
+        """
+        the opaque proves the nonce was issued to this client by one of the workers, nc is checked against
+        t_digest_nonce afterwards
+
+        Returns: (challenge time, nc)
+        """
+        received_time = self.verify_opaque(params['opaque'], params['nonce'], clientip)
+
+        try:
+            nc = int(params.get('nc', '0'), 16)
+        except ValueError:
+            raise DigestAuthError('Invalid response, invalid nc value')
+
+        if not 0 < nc <= self.MAX_NC:
+            raise DigestAuthError('Invalid response, invalid nc value')
+
+        return received_time, nc
+
     def verify_opaque(self, opaque, nonce, clientip):
         try:
             received_digest, received_ekey = opaque.split('-')
@@ -244,10 +468,10 @@ class DigestAuth(object):
             raise DigestAuthError('Invalid response, incompatible opaque/nonce too old')
 
         digest = self.hexdigest_str(received_key.encode('ascii') + self.DIGEST_PRIVATE_KEY)
-        if received_digest != digest:
+        if not hmac.compare_digest(received_digest, digest):
             raise DigestAuthError('Invalid response, invalid opaque value')
 
-        return True
+        return received_time
 
     async def calculate_expected_response(self, challenge, params):
         algo = params.get('algorithm', 'md5').lower()
@@ -258,10 +482,9 @@ class DigestAuth(object):
         nc = params['nc']
         cnonce = params['cnonce']
 
-        print(user, challenge)
         ha1 = self.HA1(algo, user, realm, challenge, nonce, cnonce)
-        request_body = await self.request.body()
-        ha2 = self.HA2(self.request.method, self.request.url.path, qop, request_body.decode())
+        body_hash = await self.hash_body() if qop == 'auth-int' else None
+        ha2 = self.HA2(self.request.method, self.request.url.path, qop, body_hash)
 
         data = (ha1, nonce, nc, cnonce, qop, ha2)
         return self.hexdigest_str(':'.join(data).encode('ascii'))
@@ -276,13 +499,17 @@ class DigestAuth(object):
 
         return ha1
 
-    def HA2(self, method, digest_uri, qop, body):
+    def HA2(self, method, digest_uri, qop, body_hash):
         data = [method, digest_uri]
         if qop and qop == 'auth-int':
-            data.append(self.hexdigest_str(body))
+            data.append(body_hash)
 
         return self.hexdigest_str(':'.join(data).encode('ascii'))
 
+    async def hash_body(self) -> str:
+        # request.body() keeps the body on the request, so the endpoint can still read it afterwards
+        return self.hexdigest_str(await self.request.body())
+
 
 def is_internal_user(user: CurrentUser) -> bool:
     return user.authority_code < 4
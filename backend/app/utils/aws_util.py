@@ -1,4 +1,6 @@
 import aioboto3
+import base64
+import hashlib
 from botocore.exceptions import ClientError
 from io import BytesIO
 from typing import LiteralString, Any
@@ -49,12 +51,22 @@ class S3KeyCacheMixin:
 
 
 class S3Client(S3KeyCacheMixin):
+    """
+    S3 is strongly read-after-write consistent, so by default an operation is judged by its own response:
+    put_object sends Content-MD5 (S3 rejects a corrupted body) and must answer 200 with an ETag, delete_object
+    2xx, and a missing key is the 404 of the GET itself. one request per operation.
+
+    verify_after_write=True (or settings.S3_VERIFY_AFTER_WRITE) brings back the HEAD checks: the key must
+    exist before a delete and a put / delete is confirmed by a HEAD afterwards.
+    """
     UPLOAD_MAX_TRY_COUNT = 3
+    NOT_FOUND_CODES = ("404", "NoSuchKey")
 
-    def __init__(self):
+    def __init__(self, verify_after_write: bool | None = None):
         self.bucket = settings.S3_BUCKET
         self.s3_client = None
-        self.operations_no_need_to_check_result = ["download_fileobj", "list_objects_v2"]
+        self.verify_after_write = settings.S3_VERIFY_AFTER_WRITE if verify_after_write is None else verify_after_write
+        self.operations_no_need_to_check_result = ["download_fileobj", "get_object", "list_objects_v2"]
         self.operation_check_result_mapping = {"put_object": True, "delete_object": False}
 
     async def __aenter__(self):
@@ -84,23 +96,23 @@ class S3Client(S3KeyCacheMixin):
         if not isinstance(bytes_io, bytes):
             bytes_io = orjson.dumps(bytes_io)
 
-        await self._do_operation("put_object", key, Bucket=self.bucket, Key=key, Body=bytes_io)
+        content_md5 = base64.b64encode(hashlib.md5(bytes_io).digest()).decode("ascii")
+        await self._do_operation("put_object", key, Bucket=self.bucket, Key=key, Body=bytes_io, ContentMD5=content_md5)
 
     async def delete_object_from_s3(self, *, key: str = "") -> None:
-        if not await self.check_file_exists(key):
+        """
+        without verify_after_write deleting a missing key succeeds (S3 answers 204 either way)
+        """
+        if self.verify_after_write and not await self.check_file_exists(key):
             raise NotFoundError(f"file {key} not found in s3")
 
         await self._do_operation("delete_object", key, Bucket=self.bucket, Key=key)
 
     async def get_object_from_s3(self, key: str) -> BytesIO:
-        if not await self.check_file_exists(key):
-            raise NotFoundError(f"file {key} not found in s3")
-
-        file_stream = BytesIO()
-        await self._do_operation("download_fileobj", key, Bucket=self.bucket, Key=key, Fileobj=file_stream)
-
-        file_stream.seek(0)  # reset pointer
-        return file_stream
+        # a plain GET: no HEAD first (download_fileobj would send one too), a missing key is its 404
+        response = await self._do_operation("get_object", key, Bucket=self.bucket, Key=key)
+        async with response["Body"] as body:
+            return BytesIO(await body.read())
 
     async def get_object_contain_kw_from_s3(self, folder: str, kw: str) -> tuple[str, BytesIO]:
         files: list[str] = await self.list_objects_in_s3(folder)
@@ -127,13 +139,19 @@ class S3Client(S3KeyCacheMixin):
                 res = await _operation(*args, **kwargs)
 
                 # check the operation result and retry when failed
-                if await self.check_operation_done(key, _check_answer):
+                if self.verify_after_write:
+                    done = await self.check_operation_done(key, _check_answer)
+                else:
+                    done = _check_answer is None or self.check_operation_response(func, res)
+                if done:
                     logger.info({"status": "success", "s3_key": key, "try_count": i + 1}, extra=func)
                     return res
                 else:
-                    raise ClientError("check operation failed", func)
+                    raise ClientError({"Error": {"Code": "CheckFailed", "Message": "check operation failed"}}, func)
 
             except ClientError as e:
+                if e.response.get("Error", {}).get("Code") in self.NOT_FOUND_CODES:
+                    raise NotFoundError(f"file {key} not found in s3")
                 logger.error({"status": "failed", "s3_key": key, "error_detail": str(e), "try_count": i + 1},
                              extra=func)
 
@@ -141,6 +159,14 @@ class S3Client(S3KeyCacheMixin):
         else:
             raise InternalServerError(f"s3 operation {func} failed")
 
+    @staticmethod
+    def check_operation_response(func: str, response: dict) -> bool:
+        status_code = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        if func == "put_object":
+            # Content-MD5 was sent, so a 200 with an ETag means S3 stored exactly this body
+            return status_code == 200 and bool(response.get("ETag"))
+        return status_code is not None and 200 <= status_code < 300
+
     async def check_operation_done(self, file_key: str, answer: bool | None) -> bool:
         # no need to check
         if answer is None:
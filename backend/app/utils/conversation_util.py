@@ -0,0 +1,114 @@
+import bisect
+import time
+
+from config import settings
+from custom_types import MessageRecord
+from database import MESSAGE_ADDED_CHANNEL, MESSAGE_CHANGED_CHANNEL, Message
+from .cache_util import TTLLRUCache
+from .crud_util import Session
+from .notify_util import pg_listener
+
+
+def to_record(message: Message) -> MessageRecord:
+    return MessageRecord(id=message.id,
+                         conversation_id=message.conversation_id,
+                         role=message.role,
+                         content=message.content,
+                         created_at=message.created_at)
+
+
+class ConversationTailCache:
+    """
+    last tail_size messages (chronological) of the conversations this worker is serving, so a chat turn
+    doesn't re-read the history from t_message.
+
+    appends made through this cache update it in place. every worker LISTENs on MESSAGE_ADDED_CHANNEL
+    ("<conversation_id>:<message_id>") and drops a conversation when a message it doesn't hold yet shows up,
+    i.e. one written by another worker, and on MESSAGE_CHANGED_CHANNEL for edited / deleted messages.
+    like the user cache it is bypassed while the listener is down.
+    idle conversations expire after ttl_seconds.
+    """
+    def __init__(self, tail_size: int, max_size: int, ttl_seconds: int):
+        self.tail_size = tail_size
+        self.ttl_seconds = ttl_seconds
+        self.cache = TTLLRUCache("conversation_tail", max_size=max_size)
+        self._generation = 0
+        # conversation_id -> appends of this worker in flight / ids notified meanwhile
+        self._appending: dict[int, int] = {}
+        self._held: dict[int, set[int]] = {}
+
+    async def get_tail(self, conversation_id: int) -> list[MessageRecord]:
+        if pg_listener.listening:
+            tail = self.cache.get(conversation_id)
+            if tail is not None:
+                self._touch(conversation_id, tail)
+                return list(tail)
+
+        generation = self._generation
+        async with Session(use_primary=True) as db:
+            messages = await db.get_latest_messages(conversation_id, self.tail_size)
+        tail = [to_record(message) for message in messages]
+
+        # a message that arrived while loading may be missing from the rows just read
+        if pg_listener.listening and generation == self._generation:
+            self._touch(conversation_id, tail)
+        return list(tail)
+
+    async def add_message(self, conversation_id: int, role: str, content: str) -> MessageRecord:
+        # this worker's own NOTIFY can be handled before the commit returns here, so while an append is in
+        # flight unknown ids are held back and only invalidate if the append didn't bring them in
+        self._appending[conversation_id] = self._appending.get(conversation_id, 0) + 1
+        try:
+            async with Session(use_primary=True) as db:
+                message = await db.add_message(conversation_id, role, content)
+            record = to_record(message)
+
+            tail = self.cache.get(conversation_id, count=False)
+            if tail is not None:
+                # concurrent appends to one conversation may commit out of order
+                bisect.insort(tail, record, key=lambda m: m.id)
+                del tail[:-self.tail_size]
+        finally:
+            self._appending[conversation_id] -= 1
+            if not self._appending[conversation_id]:
+                del self._appending[conversation_id]
+                held = self._held.pop(conversation_id, set())
+                tail = self.cache.get(conversation_id, count=False)
+                if tail is not None and held - {m.id for m in tail}:
+                    self.invalidate(conversation_id)
+        return record
+
+    def on_message_added(self, payload: str) -> None:
+        conversation_id, message_id = (int(part) for part in payload.split(":"))
+        tail = self.cache.get(conversation_id, count=False)
+        if tail is not None and not any(m.id == message_id for m in tail):
+            if conversation_id in self._appending:
+                self._held.setdefault(conversation_id, set()).add(message_id)
+            else:
+                self.invalidate(conversation_id)
+
+    def on_message_changed(self, payload: str) -> None:
+        self.invalidate(int(payload))
+
+    def invalidate(self, conversation_id: int | None = None) -> None:
+        self._generation += 1
+        if conversation_id is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(conversation_id)
+
+    def _touch(self, conversation_id: int, tail: list[MessageRecord]) -> None:
+        self.cache.set(conversation_id, tail, time.time() + self.ttl_seconds)
+
+    def stats(self) -> dict:
+        return {"listening": pg_listener.listening, "tail_size": self.tail_size, **self.cache.stats()}
+
+
+conversation_tail_cache = ConversationTailCache(tail_size=settings.CONVERSATION_TAIL_SIZE,
+                                                max_size=settings.CONVERSATION_CACHE_SIZE,
+                                                ttl_seconds=settings.CONVERSATION_CACHE_TTL_SECONDS)
+pg_listener.subscribe(MESSAGE_ADDED_CHANNEL,
+                      on_notify=conversation_tail_cache.on_message_added,
+                      on_connect=conversation_tail_cache.invalidate,
+                      on_disconnect=conversation_tail_cache.invalidate)
+pg_listener.subscribe(MESSAGE_CHANGED_CHANNEL, on_notify=conversation_tail_cache.on_message_changed)
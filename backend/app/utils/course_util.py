@@ -0,0 +1,195 @@
+import asyncio
+import math
+import threading
+import numpy as np
+
+from custom_types import CourseRecord, MountainRecord
+from database import TOUR_COURSE_CHANGED_CHANNEL, TourCourse
+from .crud_util import Session
+from .mountain_util import EARTH_RADIUS_KM, MountainSpatialIndex, mountain_catalog
+from .notify_util import pg_listener
+from .logger_util import logger
+
+
+def to_record(course: TourCourse) -> CourseRecord:
+    return CourseRecord(id=course.id,
+                        mountain_id=course.mountain_id,
+                        course_name=course.course_name,
+                        course_distance=course.course_distance,
+                        course_duration=course.course_duration,
+                        course_difficulty=course.course_difficulty)
+
+
+class CourseRecommender:
+    """
+    every t_tour_course row joined to its mountain's coordinates, as columnar numpy arrays sorted by latitude.
+    a request is one binary searched latitude band, one matrix product for the distances and a few masks, then
+    a weighted score over what's left, so the whole catalog is ranked without a python loop.
+
+    courses are read when the NOTIFY listener (re)connects (or on first use) and re-read by id from
+    TOUR_COURSE_CHANGED_CHANNEL. mountains come from mountain_catalog, which calls rebuild() on every change.
+    """
+    DEBOUNCE_SECONDS = 0.5
+    # score = weighted sum of how much of the time budget / difficulty limit a course uses and how close it is
+    DURATION_WEIGHT = 0.5
+    DISTANCE_WEIGHT = 0.3
+    DIFFICULTY_WEIGHT = 0.2
+
+    def __init__(self):
+        self.records: dict[int, CourseRecord] = {}
+        self.loaded = False
+        self.rebuilds = 0
+        self._mountains: dict[int, MountainRecord] = {}
+        self._data = self._build([], {})
+        self._changed: set[int] = set()
+        self._refresh_task: asyncio.Task | None = None
+        self._load_lock = asyncio.Lock()
+        # course refreshes and mountain_catalog rebuilds both run in threads, the last one in must see both inputs
+        self._build_lock = threading.Lock()
+
+    @staticmethod
+    def _build(courses: list[CourseRecord], mountains: dict[int, MountainRecord]) -> dict:
+        joined = []
+        for course in courses:
+            mountain = mountains.get(course.mountain_id)
+            if mountain is not None and mountain.latitude is not None and mountain.longitude is not None:
+                joined.append((course, mountain))
+        joined.sort(key=lambda pair: pair[1].latitude)
+
+        def column(values) -> np.ndarray:
+            # NULL -> nan, which fails every <= filter
+            return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+
+        latitudes = column(mountain.latitude for _, mountain in joined)
+        lat_rad = np.radians(latitudes)
+        lon_rad = np.radians(column(mountain.longitude for _, mountain in joined))
+        return {
+            "latitudes": latitudes,
+            "unit_vectors": np.column_stack((np.cos(lat_rad) * np.cos(lon_rad),
+                                             np.cos(lat_rad) * np.sin(lon_rad),
+                                             np.sin(lat_rad))),
+            "durations": column(course.course_duration for course, _ in joined),
+            "difficulties": column(course.course_difficulty for course, _ in joined),
+            "courses": [course for course, _ in joined],
+            "mountains": [mountain for _, mountain in joined],
+        }
+
+    def _rebuild_locked(self, mountains: list[MountainRecord] | None = None) -> None:
+        with self._build_lock:
+            if mountains is not None:
+                self._mountains = {mountain.id: mountain for mountain in mountains}
+            self._data = self._build(list(self.records.values()), self._mountains)
+            self.rebuilds += 1
+
+    def rebuild(self, records: list[MountainRecord]) -> None:
+        # called by mountain_catalog (in a thread) whenever a mountain changes
+        self._rebuild_locked(records)
+
+    def __len__(self) -> int:
+        return len(self._data["courses"])
+
+    async def ensure_loaded(self) -> None:
+        await mountain_catalog.ensure_loaded()
+        if not self.loaded:
+            async with self._load_lock:
+                if not self.loaded:
+                    await self._reload()
+
+    async def reload(self) -> None:
+        async with self._load_lock:
+            await self._reload()
+
+    async def _reload(self) -> None:
+        async with Session() as db:
+            courses = await db.get_tour_courses()
+        self.records = {course.id: to_record(course) for course in courses}
+        await asyncio.to_thread(self._rebuild_locked)
+        self.loaded = True
+        logger.info({"courses": len(self.records), "located": len(self)}, extra="course_catalog_reload")
+
+    def on_notify(self, payload: str) -> None:
+        self._changed.add(int(payload))
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_changed())
+
+    async def _refresh_changed(self) -> None:
+        try:
+            while self._changed:
+                await asyncio.sleep(self.DEBOUNCE_SECONDS)
+                async with self._load_lock:
+                    ids, self._changed = list(self._changed), set()
+                    if not self.loaded:
+                        continue
+                    # on the primary, which sent the NOTIFY: a lagging replica would drop the course
+                    async with Session(use_primary=True) as db:
+                        courses = {course.id: course for course in await db.get_tour_courses(ids)}
+
+                    records = dict(self.records)
+                    for course_id in ids:
+                        if course_id in courses:
+                            records[course_id] = to_record(courses[course_id])
+                        else:
+                            records.pop(course_id, None)
+                    self.records = records
+                    await asyncio.to_thread(self._rebuild_locked)
+        finally:
+            self._refresh_task = None
+
+    def recommend(self, latitude: float, longitude: float, radius_km: float,
+                  max_duration: int | None = None, max_difficulty: int | None = None,
+                  limit: int = 10) -> list[tuple[CourseRecord, MountainRecord, float, float]]:
+        """
+        courses within radius_km that take at most max_duration minutes and are at most max_difficulty.
+        a course scores higher the more of the time budget and difficulty limit it uses and the closer it is.
+
+        Returns: [(course, mountain, distance_km, score)], best first
+        """
+        data = self._data
+        angle = radius_km / EARTH_RADIUS_KM
+        if not data["courses"] or angle <= 0 or limit <= 0:
+            return []
+
+        band = math.degrees(angle)
+        lo = int(np.searchsorted(data["latitudes"], latitude - band, side="left"))
+        hi = int(np.searchsorted(data["latitudes"], latitude + band, side="right"))
+        cosines = data["unit_vectors"][lo:hi] @ MountainSpatialIndex._unit_vector(latitude, longitude)
+        durations = data["durations"][lo:hi]
+        difficulties = data["difficulties"][lo:hi]
+
+        mask = cosines >= math.cos(min(angle, math.pi))
+        if max_duration is not None:
+            mask &= durations <= max_duration
+        if max_difficulty is not None:
+            mask &= difficulties <= max_difficulty
+        rows = np.flatnonzero(mask)
+        if not len(rows):
+            return []
+
+        distances = EARTH_RADIUS_KM * np.arccos(np.clip(cosines[rows], -1.0, 1.0))
+        scores = self.DISTANCE_WEIGHT * (1.0 - distances / radius_km)
+        # without a limit every course uses all of it
+        scores += self.DURATION_WEIGHT * (durations[rows] / max_duration if max_duration else 1.0)
+        scores += self.DIFFICULTY_WEIGHT * (difficulties[rows] / max_difficulty if max_difficulty else 1.0)
+
+        if limit < len(rows):
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            rows, distances, scores = rows[top], distances[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        courses, mountains = data["courses"], data["mountains"]
+        return [(courses[lo + row], mountains[lo + row], distance, score)
+                for row, distance, score in zip(rows[order].tolist(), distances[order].tolist(),
+                                                scores[order].tolist())]
+
+    def stats(self) -> dict:
+        return {"loaded": self.loaded,
+                "courses": len(self.records),
+                "located": len(self),
+                "rebuilds": self.rebuilds,
+                "pending_changes": len(self._changed)}
+
+
+# use this instance directly as singleton
+course_recommender = mountain_catalog.register(CourseRecommender())
+pg_listener.subscribe(TOUR_COURSE_CHANGED_CHANNEL,
+                      on_notify=course_recommender.on_notify,
+                      on_connect=course_recommender.reload)
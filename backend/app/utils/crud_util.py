@@ -1,5 +1,13 @@
-from typing import Any, Literal
-from sqlalchemy import select, desc, asc, or_, String
+from typing import Any, Literal, AsyncIterator
+from contextlib import asynccontextmanager
+import math
+import base64
+import binascii
+import orjson
+from sqlalchemy import select, update, delete, desc, asc, or_, and_, bindparam, tuple_, values, column, text
+from sqlalchemy import String, Integer, SmallInteger, BigInteger, DateTime, cast
+from sqlalchemy.types import TypeEngine
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import selectinload
 from sqlalchemy.sql import func
 from sqlalchemy.sql.base import Executable
@@ -7,30 +15,139 @@ from datetime import timedelta, datetime
 from uuid import UUID, uuid4
 
 from config import settings
-from exceptions import NotFoundError
+from exceptions import NotFoundError, BadRequestError
 from schemas.user import UserCreateSchema
-from database import async_session
+from custom_types import UserProfile
+from utils.cache_util import TTLLRUCache
+from utils.executor_util import latency_stats
+from database import async_session, now_jst, engine, replicas
 from database import (User,
-                      UserBaseInfo)
+                      UserBaseInfo,
+                      RevokedToken,
+                      RefreshTokenFamily,
+                      Conversation,
+                      Message,
+                      Quota,
+                      Mountain,
+                      TourCourse,
+                      Tour,
+                      AppSetting,
+                      DigestNonce)
+
+
+# t_user + t_user_base_info columns of a UserProfile, in field order
+USER_PROFILE_COLUMNS = (User.id, User.username, User.authority_level,
+                        UserBaseInfo.nickname, UserBaseInfo.gender, UserBaseInfo.phone_number,
+                        UserBaseInfo.org_name, UserBaseInfo.post_number, UserBaseInfo.city_id,
+                        UserBaseInfo.district_id, UserBaseInfo.address,
+                        User.created_at, User.update_datetime)
+
+
+def encode_cursor(value: Any, pk: Any) -> str:
+    # opaque to the client: urlsafe base64 of [kind, last ordering value, last primary key]
+    payload = ["dt", value.isoformat(), pk] if isinstance(value, datetime) else ["v", value, pk]
+    return base64.urlsafe_b64encode(orjson.dumps(payload)).decode("ascii").rstrip("=")
+
+
+def bindable(value: Any, column_type: TypeEngine) -> bool:
+    # a value asyncpg would refuse for the column (DataError, a 500) is a client error
+    python_type = column_type.python_type
+    if python_type is int:
+        bits = 64 if isinstance(column_type, BigInteger) else 16 if isinstance(column_type, SmallInteger) else 32
+        return type(value) is int and -2 ** (bits - 1) <= value < 2 ** (bits - 1)
+    if python_type is float:
+        return type(value) in (int, float)
+    if python_type is datetime:
+        return isinstance(value, datetime) and (value.tzinfo is not None) == bool(column_type.timezone)
+    return isinstance(value, python_type)
+
+
+def decode_cursor(cursor: str, value_type: TypeEngine, pk_type: TypeEngine) -> tuple[Any, Any]:
+    """
+    value_type / pk_type: types of the ordering column and the primary key, the decoded values must fit them
+    """
+    try:
+        kind, value, pk = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if kind == "dt":
+            value = datetime.fromisoformat(value)
+    except (ValueError, TypeError, binascii.Error):
+        raise BadRequestError("invalid cursor")
+    if not bindable(value, value_type) or not bindable(pk, pk_type):
+        raise BadRequestError("invalid cursor")
+    return value, pk
 
 
 async def get_session():
+    # lazy: nothing is checked out until the handler runs its first statement
     async with Session() as session:
         yield session
 
 
+async def get_primary_session():
+    # for endpoints that write: reads and writes in one transaction on the primary
+    async with Session(use_primary=True) as session:
+        yield session
+
+
+@asynccontextmanager
+async def session_advisory_lock(lock_id: int) -> AsyncIterator[bool]:
+    """
+    pg_try_advisory_lock on a dedicated autocommit connection to the primary, held until the block exits.
+    no transaction stays open while it is held, so work under the lock commits in its own sessions
+    Returns: False when another connection holds the lock
+    """
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        locked = await conn.scalar(text("SELECT pg_try_advisory_lock(:lock_id)"), {"lock_id": lock_id})
+        try:
+            yield locked
+        finally:
+            if locked:
+                try:
+                    await conn.execute(text("SELECT pg_advisory_unlock(:lock_id)"), {"lock_id": lock_id})
+                except BaseException:
+                    # the lock lives as long as the connection, don't hand it back to the pool
+                    await conn.invalidate()
+                    raise
+
+
+def get_pool_stats() -> dict:
+    def pool_stats(async_engine) -> dict:
+        pool = async_engine.sync_engine.pool
+        return {"size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+                "timeouts": pool.timeouts,
+                "checkout_wait": latency_stats(pool.wait_ms, pool.checkouts),
+                "hold": latency_stats(pool.hold_ms, pool.checkouts)}
+
+    return {"primary": pool_stats(engine),
+            "replicas": {e.url.render_as_string(hide_password=True): pool_stats(e) for e in replicas.engines}}
+
+
 class BaseSession:
-    def __init__(self):
-        self.session = async_session()
+    # (orm class, mode, filter keys, ordering) -> select() with bind parameters, shared by every session
+    statement_cache = TTLLRUCache("statement", max_size=settings.STATEMENT_CACHE_SIZE)
+
+    def __init__(self, use_primary: bool = False):
+        # use_primary: one transaction on the primary for every statement, for sessions that write
+        # and reads that must not lag behind a write (see database.RoutingSession)
+        self.session = async_session(info={"use_primary": use_primary})
 
     async def __aenter__(self):
-        await self.session.begin()
+        # no begin(): a connection is checked out on the first statement, read-only sessions run in autocommit
+        # and only a session that wrote commits
         return self
 
+    @property
+    def wrote(self) -> bool:
+        session = self.session
+        return bool(session.info.get("wrote") or session.new or session.dirty or session.deleted)
+
     async def __aexit__(self, exc_type, exc_value, traceback):
         if exc_type:
             await self.session.rollback()
-        else:
+        elif self.wrote:
             await self.session.commit()
         await self.session.close()
 
@@ -50,6 +167,74 @@ class BaseSession:
         self.session.add(orm_obj)
         await self.session.flush()
 
+    async def add_records(self,
+                          _db,
+                          rows: list[dict],
+                          ignore_conflicts: list[str] | None = None,
+                          batch_size: int = settings.BULK_INSERT_BATCH_SIZE) -> list:
+        """
+        multi-row INSERT ... RETURNING of batch_size rows per round-trip. column defaults (created_at etc.)
+        are applied per row like add_record does.
+        Args:
+            _db: orm class
+            rows: {column: value} dicts
+            ignore_conflicts: unique columns; rows conflicting on them are skipped (ON CONFLICT DO NOTHING)
+        Returns: the inserted orm objects
+        """
+        inserted = []
+        for batch in self._batches(_db, rows, batch_size):
+            stmt = insert(_db).values(batch)
+            if ignore_conflicts is not None:
+                stmt = stmt.on_conflict_do_nothing(index_elements=ignore_conflicts)
+            result = await self.session.scalars(stmt.returning(_db))
+            inserted.extend(result.fetchall())
+        return inserted
+
+    async def upsert_records(self,
+                             _db,
+                             rows: list[dict],
+                             index_elements: list[str],
+                             update_columns: list[str] | None = None,
+                             batch_size: int = settings.BULK_INSERT_BATCH_SIZE) -> list:
+        """
+        INSERT ... ON CONFLICT (index_elements) DO UPDATE ... RETURNING, batch_size rows per round-trip.
+        Args:
+            _db: orm class
+            rows: {column: value} dicts
+            index_elements: columns of the unique index / primary key deciding the conflict
+            update_columns: columns overwritten on conflict, default: every given column except
+                            index_elements and created_at. update_datetime is always refreshed.
+        Returns: the inserted or updated orm objects
+        """
+        upserted = []
+        for batch in self._batches(_db, rows, batch_size):
+            stmt = insert(_db).values(batch)
+            columns = update_columns or [k for k in batch[0] if k not in index_elements and k != "created_at"]
+            set_ = {k: stmt.excluded[k] for k in columns}
+            # onupdate defaults don't fire for ON CONFLICT DO UPDATE
+            if "update_datetime" in _db.__table__.c:
+                set_["update_datetime"] = now_jst()
+
+            stmt = (stmt.
+                    on_conflict_do_update(index_elements=index_elements, set_=set_).
+                    returning(_db).
+                    execution_options(populate_existing=True))
+            result = await self.session.scalars(stmt)
+            upserted.extend(result.fetchall())
+        return upserted
+
+    @staticmethod
+    def _batches(_db, rows: list[dict], batch_size: int):
+        # a multi-row VALUES needs the same columns in every row, and postgres allows 32767 bind params
+        groups: dict[tuple, list[dict]] = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+
+        for group in groups.values():
+            size = max(1, min(batch_size, 32767 // len(_db.__table__.c)))
+            for i in range(0, len(group), size):
+                yield group[i:i + size]
+
     @staticmethod
     def update_record(orm_obj, update_data: dict) -> None:
         for k, v in update_data.items():
@@ -64,13 +249,123 @@ class BaseSession:
                                _ordering: tuple[str, Literal["desc", "asc"]] | None = None,
                                _mode: Literal["one", "or", "all", "all_or"] | str = "one",
                                stmt: Executable | None = None) -> Any:
-        stmt = stmt if stmt is not None else self._build_stmt(_db, _filtering, _ordering, _mode)
+        if stmt is not None:
+            params = {}
+        else:
+            stmt, params = self._get_stmt(_db, _filtering, _ordering, _mode)
 
         if _mode in ["all", "all_or"]:
-            result = await self.session.scalars(stmt)
+            result = await self.session.scalars(stmt, params)
             return result.fetchall()
         else:
-            return await self.session.scalar(stmt)
+            return await self.session.scalar(stmt, params)
+
+    @classmethod
+    def _get_stmt(cls,
+                  _db,
+                  _filtering: dict | None = None,
+                  _ordering: tuple[str, Literal["desc", "asc"]] | None = None,
+                  _mode: str = "one") -> tuple[Executable, dict]:
+        """
+        same args as _build_stmt. only the shape of the query is cached, the filter values are returned
+        as bind parameters for the execution.
+        Returns: (stmt, params)
+        """
+        _filtering = _filtering or {}
+        null_keys = frozenset(k for k, v in _filtering.items() if v is None)
+        shape = (_db, _mode, frozenset(_filtering), null_keys, _ordering)
+
+        stmt = cls.statement_cache.get(shape)
+        if stmt is None:
+            stmt = cls._build_stmt(_db, _filtering, _ordering, _mode)
+            cls.statement_cache.set(shape, stmt, expires_at=math.inf)
+
+        params = {f"f_{k}": v for k, v in _filtering.items() if k not in null_keys}
+        return stmt, params
+
+    @classmethod
+    def _get_page_stmt(cls,
+                       _db,
+                       _filtering: dict | None = None,
+                       _ordering: tuple[str, Literal["desc", "asc"]] | None = None,
+                       after_cursor: bool = False) -> tuple[Executable, dict]:
+        """
+        keyset page of the "all" query: ORDER BY (ordering column, primary key) and, after the first page,
+        WHERE (ordering column, primary key) > / < (:c_value, :c_pk). the ordering column must not be nullable.
+        the page size is bound as :p_limit.
+        """
+        base_stmt, params = cls._get_stmt(_db, _filtering, None, "all")
+        shape = ("page", base_stmt, _ordering, after_cursor)
+
+        stmt = cls.statement_cache.get(shape)
+        if stmt is None:
+            pk = _db.__mapper__.primary_key[0]
+            key = getattr(_db, _ordering[0]) if _ordering is not None and _ordering[0] != pk.key else pk
+            is_desc = _ordering is not None and _ordering[1] == "desc"
+            _order_func = desc if is_desc else asc
+
+            if key is pk:
+                # ordered by the primary key itself: the keyset is just (:c_pk)
+                stmt = base_stmt.order_by(_order_func(pk))
+                keyset, last = pk, bindparam("c_pk", type_=pk.type)
+            else:
+                stmt = base_stmt.order_by(_order_func(key), _order_func(pk))
+                keyset = tuple_(key, pk)
+                last = tuple_(bindparam("c_value", type_=key.type), bindparam("c_pk", type_=pk.type))
+            stmt = stmt.limit(bindparam("p_limit", type_=Integer))
+            if after_cursor:
+                stmt = stmt.where(keyset < last if is_desc else keyset > last)
+            cls.statement_cache.set(shape, stmt, expires_at=math.inf)
+
+        return stmt, params
+
+    async def _get_page(self,
+                        _db,
+                        _filtering: dict | None = None,
+                        _ordering: tuple[str, Literal["desc", "asc"]] | None = None,
+                        limit: int = settings.DEFAULT_PAGE_SIZE,
+                        cursor: str | None = None) -> tuple[list, str | None]:
+        """
+        Returns: (rows, cursor of the next page or None on the last page)
+        """
+        limit = max(1, min(limit, settings.MAX_PAGE_SIZE))
+        stmt, params = self._get_page_stmt(_db, _filtering, _ordering, after_cursor=cursor is not None)
+        pk_column = _db.__mapper__.primary_key[0]
+        if cursor is not None:
+            key_column = getattr(_db, _ordering[0]) if _ordering is not None else pk_column
+            params["c_value"], params["c_pk"] = decode_cursor(cursor, key_column.type, pk_column.type)
+        params["p_limit"] = limit + 1
+
+        result = await self.session.scalars(stmt, params)
+        rows = result.fetchall()
+        if len(rows) <= limit:
+            return rows, None
+
+        rows = rows[:limit]
+        pk_key = pk_column.key
+        last_value = getattr(rows[-1], _ordering[0] if _ordering is not None else pk_key)
+        return rows, encode_cursor(last_value, getattr(rows[-1], pk_key))
+
+    async def _stream_stmt_result(self,
+                                  _db=None,
+                                  _filtering: dict | None = None,
+                                  _ordering: tuple[str, Literal["desc", "asc"]] | None = None,
+                                  _mode: Literal["all", "all_or"] = "all",
+                                  stmt: Executable | None = None,
+                                  batch_size: int = 1000) -> AsyncIterator:
+        """
+        server side cursor fetching batch_size rows at a time, for batch jobs walking a whole table.
+        the session has to stay open until the iteration ends.
+        """
+        if stmt is not None:
+            params = {}
+        else:
+            stmt, params = self._get_stmt(_db, _filtering, _ordering, _mode)
+
+        # on the statement itself, so the session routes it to a transactional connection
+        result = await self.session.stream_scalars(stmt.execution_options(yield_per=batch_size), params)
+        async for row in result:
+            yield row
 
     @staticmethod
     def _build_stmt(_db,
@@ -80,7 +375,7 @@ class BaseSession:
         """
         Args:
             _db: orm class
-            _filtering: dictionary to put the {key: value} data
+            _filtering: dictionary to put the {key: value} data, values are bound as parameters named "f_{key}"
             _ordering: tuple to order by. ("KEY to order by", "desc or asc")
             _mode: "one", "or", "all"
                 - "one": get one result with AND condition to combine _filtering param
@@ -93,20 +388,13 @@ class BaseSession:
         assert _db is not None
 
         stmt = select(_db)
-        if _filtering is None:
-            stmt = stmt
-        else:
+        if _filtering:
+            conditions = [getattr(_db, k).is_(None) if v is None else getattr(_db, k) == bindparam(f"f_{k}")
+                          for k, v in _filtering.items()]
             if _mode in ["or", "all_or"]:
-                or_condition = None
-                for k, v in _filtering.items():
-                    if or_condition is None:
-                        or_condition = (getattr(_db, k) == v)
-                    else:
-                        or_condition = or_condition | (getattr(_db, k) == v)
-                else:
-                    stmt = stmt.where(or_condition)
+                stmt = stmt.where(or_(*conditions))
             else:
-                stmt = stmt.filter_by(**_filtering)
+                stmt = stmt.where(and_(*conditions))
 
         if _ordering is not None:
             key, order = _ordering
@@ -123,9 +411,20 @@ class Session(BaseSession):
     async def get_user_by_username(self, username: str) -> User | None:
         return await self._get_user({"username": username})
 
+    async def get_existing_usernames(self, usernames: list[str]) -> set[str]:
+        result = await self.session.scalars(select(User.username).where(User.username.in_(usernames)))
+        return set(result)
+
     async def get_users(self) -> list[User]:
         return await self._get_user(_mode="all")
 
+    async def get_users_page(self, limit: int = settings.DEFAULT_PAGE_SIZE,
+                             cursor: str | None = None) -> tuple[list[User], str | None]:
+        return await self._get_page(User, limit=limit, cursor=cursor)
+
+    def stream_users(self, batch_size: int = 1000) -> AsyncIterator[User]:
+        return self._stream_stmt_result(User, _ordering=("id", "asc"), batch_size=batch_size)
+
     async def _get_user(self, _filtering=None, _ordering=None, _mode: str = "one",
                         stmt=None) -> User | list[User] | None:
         return await self._get_stmt_result(_db=User, _filtering=_filtering, _ordering=_ordering, _mode=_mode, stmt=stmt)
@@ -137,10 +436,254 @@ class Session(BaseSession):
         await self.add_record(new_user)
         return new_user
 
-    async def get_user_base_info(self, user_guid: int):
-        stmt = (select(User, UserBaseInfo).
-                join(User.base_info).
-                where(User.user_guid == user_guid))
-        res = await self.session.execute(stmt)
+    async def add_users(self, data: list[UserCreateSchema]) -> list[str]:
+        """
+        insert users in batches of BULK_INSERT_BATCH_SIZE rows, skipping usernames that already exist
+        Returns: usernames actually created
+        """
+        rows = [{**user.model_dump(), "id": str(uuid4())} for user in data]
+        created = await self.add_records(User, rows, ignore_conflicts=["username"])
+        return [user.username for user in created]
+
+    async def update_user_password_hash(self, user_id: str, old_hash: str, new_hash: str) -> bool:
+        """
+        Returns: False when the password was changed in the meantime (the row is left untouched)
+        """
+        stmt = (update(User).
+                where(User.id == user_id, User.hashed_password == old_hash).
+                values(hashed_password=new_hash))
+        result = await self.session.execute(stmt)
+        return result.rowcount == 1
+
+    @classmethod
+    def _user_profile_stmt(cls, shape: Literal["one", "page", "page_after"]) -> Executable:
+        stmt = cls.statement_cache.get(("user_profile", shape))
+        if stmt is None:
+            # plain columns: rows come back as tuples, nothing enters the identity map
+            stmt = (select(*USER_PROFILE_COLUMNS).
+                    outerjoin(UserBaseInfo, UserBaseInfo.user_id == User.id))
+            if shape == "one":
+                stmt = stmt.where(User.id == bindparam("user_id", type_=User.id.type))
+            else:
+                stmt = stmt.order_by(User.id).limit(bindparam("p_limit", type_=Integer))
+                if shape == "page_after":
+                    stmt = stmt.where(User.id > bindparam("c_pk", type_=User.id.type))
+            cls.statement_cache.set(("user_profile", shape), stmt, expires_at=math.inf)
+        return stmt
+
+    async def get_user_base_info(self, user_id: str) -> UserProfile | None:
+        result = await self.session.execute(self._user_profile_stmt("one"), {"user_id": user_id})
+        row = result.first()
+        return None if row is None else UserProfile(*row)
+
+    async def get_user_profiles_page(self, limit: int = settings.DEFAULT_PAGE_SIZE,
+                                     cursor: str | None = None) -> tuple[list[UserProfile], str | None]:
+        """
+        keyset paginated on t_user.id, same cursor format as _get_page
+        """
+        limit = max(1, min(limit, settings.MAX_PAGE_SIZE))
+        params = {"p_limit": limit + 1}
+        if cursor is not None:
+            _, params["c_pk"] = decode_cursor(cursor, User.id.type, User.id.type)
+        result = await self.session.execute(self._user_profile_stmt("page" if cursor is None else "page_after"),
+                                            params)
+        profiles = [UserProfile(*row) for row in result]
+        if len(profiles) <= limit:
+            return profiles, None
+        profiles = profiles[:limit]
+        return profiles, encode_cursor(profiles[-1].id, profiles[-1].id)
+
+    async def advisory_xact_lock(self, lock_id: int) -> None:
+        # waits for the lock, released when the session's transaction ends
+        await self.session.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": lock_id})
+
+    async def get_app_setting(self, key: str) -> dict | None:
+        return await self.session.scalar(select(AppSetting.value).where(AppSetting.key == key))
+
+    async def set_app_setting(self, key: str, value: dict) -> None:
+        stmt = insert(AppSetting).values(key=key, value=value)
+        stmt = stmt.on_conflict_do_update(index_elements=[AppSetting.key],
+                                          set_={"value": stmt.excluded.value, "update_datetime": now_jst()})
+        await self.session.execute(stmt)
+
+    async def reserve_digest_nc(self, nonce: str, nc: int, expires_at: datetime) -> bool:
+        """
+        one statement, so of two concurrent requests (any worker) with the same nc only one gets it
+
+        Returns: False when this nc or a higher one was already used with the nonce
+        """
+        stmt = insert(DigestNonce).values(nonce=nonce, last_nc=nc, expires_at=expires_at)
+        stmt = (stmt.on_conflict_do_update(index_elements=[DigestNonce.nonce],
+                                           set_={"last_nc": stmt.excluded.last_nc},
+                                           where=DigestNonce.last_nc < stmt.excluded.last_nc).
+                returning(DigestNonce.nonce))
+        return await self.session.scalar(stmt) is not None
+
+    async def delete_expired_digest_nonces(self) -> int:
+        result = await self.session.execute(delete(DigestNonce).where(DigestNonce.expires_at < func.now()))
+        return result.rowcount
+
+    async def revoke_token(self, token_id: str, expires_at: datetime) -> bool:
+        """
+        Returns: False when the token_id had already been revoked
+        """
+        stmt = (insert(RevokedToken).
+                values(token_id=token_id, expires_at=expires_at).
+                on_conflict_do_nothing(index_elements=[RevokedToken.token_id]).
+                returning(RevokedToken.id))
+        return await self.session.scalar(stmt) is not None
+
+    async def get_revoked_token_ids(self, token_ids: list[str]) -> list[str]:
+        stmt = select(RevokedToken.token_id).where(RevokedToken.token_id.in_(token_ids))
+        result = await self.session.scalars(stmt)
+        return result.fetchall()
+
+    async def get_unexpired_revoked_token_ids(self) -> list[str]:
+        stmt = select(RevokedToken.token_id).where(RevokedToken.expires_at > func.now())
+        result = await self.session.scalars(stmt)
+        return result.fetchall()
+
+    async def delete_expired_revoked_tokens(self) -> None:
+        await self.session.execute(delete(RevokedToken).where(RevokedToken.expires_at <= func.now()))
+        await self.session.execute(delete(RefreshTokenFamily).where(RefreshTokenFamily.expires_at <= func.now()))
+
+    async def advance_token_family(self, family_id: str, generation: int, expires_at: datetime) -> bool:
+        """
+        single use check of a refresh token: one statement moves the family from `generation` to the next.
+        the row is created by the first rotation of a login (generation 0)
+
+        Returns: False when that generation was already rotated
+        """
+        stmt = insert(RefreshTokenFamily).values(family_id=family_id, generation=generation + 1,
+                                                 expires_at=expires_at)
+        stmt = (stmt.on_conflict_do_update(index_elements=[RefreshTokenFamily.family_id],
+                                           set_={"generation": stmt.excluded.generation,
+                                                 "expires_at": stmt.excluded.expires_at},
+                                           where=RefreshTokenFamily.generation == generation).
+                returning(RefreshTokenFamily.generation))
+        return await self.session.scalar(stmt) is not None
+
+    async def get_conversation(self, conversation_id: int) -> Conversation | None:
+        return await self._get_stmt_result(Conversation, {"id": conversation_id})
+
+    async def get_messages_page(self, conversation_id: int, limit: int = settings.DEFAULT_PAGE_SIZE,
+                                cursor: str | None = None) -> tuple[list[Message], str | None]:
+        """
+        a conversation's history newest first, keyset paginated on (conversation_id, id)
+        """
+        return await self._get_page(Message, {"conversation_id": conversation_id}, ("id", "desc"),
+                                    limit=limit, cursor=cursor)
+
+    async def get_latest_messages(self, conversation_id: int, limit: int) -> list[Message]:
+        """
+        Returns: the last `limit` messages in chronological order
+        """
+        rows, _ = await self.get_messages_page(conversation_id, limit=limit)
+        return rows[::-1]
+
+    async def add_message(self, conversation_id: int, role: str, content: str) -> Message:
+        message = Message(conversation_id=conversation_id, role=role, content=content)
+        await self.add_record(message)
+        return message
+
+    async def create_quota(self, user_id: str, total_quota: int) -> bool:
+        """
+        Returns: False when the user already has a quota row
+        """
+        stmt = (insert(Quota).
+                values(user_id=user_id, total_quota=total_quota, used_quota=0, last_reset=func.now()).
+                on_conflict_do_nothing(index_elements=[Quota.user_id]).
+                returning(Quota.id))
+        return await self.session.scalar(stmt) is not None
+
+    async def consume_quota(self, user_id: str, amount: int) -> int | None:
+        """
+        one atomic UPDATE, the row lock is only held for this statement
+        Returns: remaining quota, None when the user has no quota row or not enough left (nothing is consumed)
+        """
+        stmt = (update(Quota).
+                where(Quota.user_id == user_id, Quota.used_quota + amount <= Quota.total_quota).
+                values(used_quota=Quota.used_quota + amount).
+                returning(Quota.total_quota - Quota.used_quota).
+                execution_options(synchronize_session=False))
+        return await self.session.scalar(stmt)
+
+    async def reserve_quota(self, user_id: str, amount: int) -> tuple[int, datetime | None]:
+        """
+        consume up to `amount`, as much as is left
+        Returns: (units granted, last_reset of the row, to hand unused units back to the same period)
+        """
+        old = (select(Quota.id, Quota.used_quota).
+               where(Quota.user_id == user_id).
+               with_for_update().
+               cte("old"))
+        stmt = (update(Quota).
+                where(Quota.id == old.c.id).
+                values(used_quota=func.least(Quota.total_quota, old.c.used_quota + amount)).
+                returning(Quota.used_quota - old.c.used_quota, Quota.last_reset).
+                execution_options(synchronize_session=False))
+        row = (await self.session.execute(stmt)).first()
+        return (0, None) if row is None else (row[0], row[1])
+
+    async def release_quotas(self, releases: list[tuple[str, int, datetime | None]]) -> None:
+        """
+        hand reserved but unused units back in one statement: [(user_id, amount, last_reset at reservation)].
+        rows reset since the reservation are left alone.
+        """
+        released = values(column("user_id", String), column("amount", Integer),
+                          column("last_reset", DateTime(timezone=True)), name="released").data(releases)
+        stmt = (update(Quota).
+                where(Quota.user_id == released.c.user_id,
+                      # a VALUES column holding only NULLs is typed text
+                      Quota.last_reset.is_not_distinct_from(cast(released.c.last_reset, DateTime(timezone=True)))).
+                values(used_quota=func.greatest(0, Quota.used_quota - released.c.amount)).
+                execution_options(synchronize_session=False))
+        await self.session.execute(stmt)
+
+    async def reset_quotas_chunk(self, reset_before: datetime, after_id: int, chunk_size: int) -> list[int]:
+        """
+        reset the next chunk_size rows (by id, after after_id) whose last_reset is older than reset_before.
+        Returns: ids of the reset rows, empty when the sweep is done
+        """
+        chunk = (select(Quota.id).
+                 where(Quota.id > after_id, or_(Quota.last_reset.is_(None), Quota.last_reset < reset_before)).
+                 order_by(Quota.id).
+                 limit(chunk_size).
+                 scalar_subquery())
+        stmt = (update(Quota).
+                where(Quota.id.in_(chunk)).
+                values(used_quota=0, last_reset=func.now()).
+                returning(Quota.id).
+                execution_options(synchronize_session=False))
+        result = await self.session.scalars(stmt)
+        return result.fetchall()
+
+    async def get_mountains(self, ids: list[int] | None = None) -> list[Mountain]:
+        if ids is None:
+            return await self._get_stmt_result(Mountain, _mode="all")
+        result = await self.session.scalars(select(Mountain).where(Mountain.id.in_(ids)))
+        return result.fetchall()
+
+    async def get_tour_courses(self, ids: list[int] | None = None) -> list[TourCourse]:
+        if ids is None:
+            return await self._get_stmt_result(TourCourse, _mode="all")
+        result = await self.session.scalars(select(TourCourse).where(TourCourse.id.in_(ids)))
+        return result.fetchall()
+
+    @staticmethod
+    def _tour_facts_stmt():
+        return select(Tour.id, Tour.user_id, Tour.tour_date, Tour.mountain_id, Tour.tour_distance,
+                      Tour.tour_up_duration, Tour.tour_down_duration, Tour.tour_difficulty)
+
+    async def stream_tour_facts(self, batch_size: int = 10000) -> AsyncIterator[tuple]:
+        """
+        (id, user_id, tour_date, mountain_id, distance, up duration, down duration, difficulty) of every tour,
+        as plain row tuples through a server side cursor
+        """
+        result = await self.session.stream(self._tour_facts_stmt().execution_options(yield_per=batch_size))
+        async for row in result:
+            yield tuple(row)
 
-        return res.fetchone()
+    async def get_tour_facts(self, ids: list[int]) -> list[tuple]:
+        result = await self.session.execute(self._tour_facts_stmt().where(Tour.id.in_(ids)))
+        return [tuple(row) for row in result]
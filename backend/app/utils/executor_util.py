@@ -0,0 +1,101 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Any
+
+from exceptions import ServiceUnavailableError
+from .logger_util import logger
+
+
+def latency_stats(samples, count: int) -> dict:
+    if not samples:
+        return {"count": count, "avg_ms": None, "p50_ms": None, "p99_ms": None, "max_ms": None}
+
+    ordered = sorted(samples)
+    return {
+        "count": count,
+        "avg_ms": round(sum(ordered) / len(ordered), 3),
+        "p50_ms": round(ordered[len(ordered) // 2], 3),
+        "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+
+class LatencyRecorder:
+    """
+    keep the latest samples (in ms) to report avg / p50 / p99 without growing unbounded
+    """
+    def __init__(self, max_samples: int = 1024):
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+
+    def record(self, ms: float) -> None:
+        self.samples.append(ms)
+        self.count += 1
+
+    def stats(self) -> dict:
+        return latency_stats(self.samples, self.count)
+
+
+class BoundedExecutor:
+    """
+    thread pool for cpu heavy, GIL releasing work (e.g. bcrypt) with a hard limit of waiting jobs.
+
+    usage:
+        result = await executor.run(func, *args)
+        raises ServiceUnavailableError(503) immediately when max_queue jobs are already waiting
+    """
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._in_flight = 0
+        self._rejected = 0
+        self.wait_latency = LatencyRecorder()
+        self.run_latency = LatencyRecorder()
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self._in_flight - self.max_workers)
+
+    async def run(self, func: Callable, *args) -> Any:
+        # counters are only touched on the event loop thread, so no lock is needed
+        if self.queue_depth >= self.max_queue:
+            self._rejected += 1
+            logger.warning({"executor": self.name, "queue_depth": self.queue_depth, "status": "rejected"},
+                           extra="bounded_executor")
+            raise ServiceUnavailableError(f"{self.name} is busy, try again later", headers={"Retry-After": "1"})
+
+        self._in_flight += 1
+        submitted_at = time.perf_counter()
+        try:
+            started_at, finished_at, result = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._timed_call, func, args)
+        finally:
+            self._in_flight -= 1
+
+        self.wait_latency.record((started_at - submitted_at) * 1000)
+        self.run_latency.record((finished_at - started_at) * 1000)
+        return result
+
+    @staticmethod
+    def _timed_call(func: Callable, args: tuple) -> tuple[float, float, Any]:
+        started_at = time.perf_counter()
+        result = func(*args)
+        return started_at, time.perf_counter(), result
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self._in_flight,
+            "queue_depth": self.queue_depth,
+            "rejected": self._rejected,
+            "wait_latency": self.wait_latency.stats(),
+            "run_latency": self.run_latency.stats(),
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
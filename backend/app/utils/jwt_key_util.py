@@ -0,0 +1,179 @@
+import asyncio
+import math
+import os
+import time
+from datetime import datetime, timezone
+import jwt
+import jwt.algorithms
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+from config import settings
+from .logger_util import logger
+
+
+class SigningKey:
+    __slots__ = ("kid", "algorithm", "private_key", "public_key", "mtime")
+
+    def __init__(self, kid: str, private_key, mtime: float):
+        self.kid = kid
+        self.private_key = private_key
+        self.public_key = private_key.public_key()
+        self.mtime = mtime
+        if isinstance(private_key, Ed25519PrivateKey):
+            self.algorithm = "EdDSA"
+        elif isinstance(private_key, ec.EllipticCurvePrivateKey) and isinstance(private_key.curve, ec.SECP256R1):
+            self.algorithm = "ES256"
+        else:
+            raise ValueError(f"unsupported jwt signing key type: {type(private_key).__name__}")
+
+    def to_jwk(self) -> dict:
+        algorithm = jwt.algorithms.OKPAlgorithm if self.algorithm == "EdDSA" else jwt.algorithms.ECAlgorithm
+        jwk = algorithm.to_jwk(self.public_key, as_dict=True)
+        jwk.update({"kid": self.kid, "alg": self.algorithm, "use": "sig"})
+        return jwk
+
+
+class JWTKeyRing:
+    """
+    asymmetric access token keys loaded from <key_dir>/<kid>.pem (Ed25519 or P-256 private keys).
+
+    rotation without restart:
+        1. drop a new key file in (see generate_signing_key), every worker picks it up within reload_seconds
+           and publishes it on the jwks endpoint right away
+        2. it becomes the signing key once the file is publish_seconds old, so verifiers can fetch it first
+        3. delete the old file after publish_seconds + ACCESS_TOKEN_EXPIRE_MINUTES
+    when the folder holds no key, access tokens stay on HS256 + SECRET_KEY. once a key is there, kid-less HS256
+    tokens are only accepted for hs256_grace_seconds after it became the signing key (see hs256_accepted).
+
+    the folder is read in a thread: reload() at startup, then the accessors start a background reload when
+    reload_seconds have passed and answer from the keys loaded so far.
+    """
+    FORCED_RELOAD_INTERVAL_SECONDS = 1
+
+    def __init__(self, key_dir: str, reload_seconds: int, publish_seconds: int, hs256_grace_seconds: int):
+        self.key_dir = key_dir
+        self.reload_seconds = reload_seconds
+        self.publish_seconds = publish_seconds
+        self.hs256_grace_seconds = hs256_grace_seconds
+        self.keys: dict[str, SigningKey] = {}
+        # mtime of the oldest key file seen by this process, never moves forward (old files get deleted)
+        self.asymmetric_since: float | None = None
+        self._next_reload = 0.0
+        self._last_forced_reload = 0.0
+        self._reload_task: asyncio.Task | None = None
+        self._jwks: dict = {"keys": []}
+
+    def _read_keys(self) -> dict[str, SigningKey]:
+        # blocking file system access, runs in a thread
+        try:
+            entries = [e for e in os.scandir(self.key_dir) if e.is_file() and e.name.endswith(".pem")]
+        except FileNotFoundError:
+            entries = []
+
+        keys = {}
+        for entry in entries:
+            kid = entry.name[:-len(".pem")]
+            mtime = entry.stat().st_mtime
+            cached = self.keys.get(kid)
+            if cached is not None and cached.mtime == mtime:
+                keys[kid] = cached
+                continue
+            try:
+                with open(entry.path, "rb") as fp:
+                    keys[kid] = SigningKey(kid, serialization.load_pem_private_key(fp.read(), password=None), mtime)
+            except (ValueError, TypeError) as e:
+                logger.error({"kid": kid, "error_detail": str(e)}, extra="jwt_key_reload")
+        return keys
+
+    def _apply(self, keys: dict[str, SigningKey]) -> None:
+        if keys.keys() != self.keys.keys():
+            logger.info({"kids": sorted(keys)}, extra="jwt_key_reload")
+        if keys:
+            oldest = min(key.mtime for key in keys.values())
+            self.asymmetric_since = oldest if self.asymmetric_since is None else min(self.asymmetric_since, oldest)
+        self.keys = keys
+        self._jwks = {"keys": [key.to_jwk() for key in keys.values()]}
+
+    async def reload(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now < self._next_reload:
+            return
+        self._next_reload = now + self.reload_seconds
+        self._apply(await asyncio.to_thread(self._read_keys))
+
+    def _reload_in_background(self) -> None:
+        if time.monotonic() < self._next_reload or (self._reload_task is not None and not self._reload_task.done()):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # no event loop (scripts / cli), nothing to block
+            self._next_reload = time.monotonic() + self.reload_seconds
+            self._apply(self._read_keys())
+            return
+        self._reload_task = loop.create_task(self.reload())
+
+    def signing_key(self) -> SigningKey | None:
+        self._reload_in_background()
+        if not self.keys:
+            return None
+
+        published_before = time.time() - self.publish_seconds
+        ready = [key for key in self.keys.values() if key.mtime <= published_before]
+        return max(ready or self.keys.values(), key=lambda key: key.kid)
+
+    def hs256_cutoff(self) -> float:
+        """
+        kid-less HS256 tokens were issued until the first key file became the signing key, so they stay valid
+        for one access token lifetime after that and never again, even if SECRET_KEY leaks later
+
+        Returns: epoch seconds after which they are rejected, inf while there is no key file
+        """
+        self._reload_in_background()
+        if self.asymmetric_since is None:
+            return math.inf
+        return self.asymmetric_since + self.publish_seconds + self.hs256_grace_seconds
+
+    def hs256_accepted(self) -> bool:
+        return time.time() < self.hs256_cutoff()
+
+    async def verification_key(self, kid: str) -> SigningKey | None:
+        self._reload_in_background()
+        key = self.keys.get(kid)
+        if key is None and time.monotonic() - self._last_forced_reload > self.FORCED_RELOAD_INTERVAL_SECONDS:
+            # signed by a worker that already saw a newer key file (rate limited, kid is client controlled)
+            self._last_forced_reload = time.monotonic()
+            await self.reload(force=True)
+            key = self.keys.get(kid)
+        return key
+
+    def jwks(self) -> dict:
+        self._reload_in_background()
+        return self._jwks
+
+
+def generate_signing_key(key_dir: str = settings.JWT_KEY_DIR) -> str:
+    os.makedirs(key_dir, exist_ok=True)
+    kid = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+    path = os.path.join(key_dir, f"{kid}.pem")
+    pem = Ed25519PrivateKey.generate().private_bytes(serialization.Encoding.PEM,
+                                                      serialization.PrivateFormat.PKCS8,
+                                                      serialization.NoEncryption())
+    with open(path, "wb") as fp:
+        fp.write(pem)
+    os.chmod(path, 0o600)
+    return path
+
+
+# use this instance directly as singleton
+jwt_key_ring = JWTKeyRing(settings.JWT_KEY_DIR,
+                          reload_seconds=settings.JWT_KEY_RELOAD_SECONDS,
+                          publish_seconds=settings.JWT_KEY_PUBLISH_SECONDS,
+                          hs256_grace_seconds=settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+
+if __name__ == '__main__':
+    # usage (from the app folder): python -m utils.jwt_key_util
+    print(generate_signing_key())
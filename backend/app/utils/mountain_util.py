@@ -0,0 +1,318 @@
+import asyncio
+import bisect
+import math
+import unicodedata
+import numpy as np
+
+from custom_types import MountainRecord
+from database import MOUNTAIN_CHANGED_CHANNEL, Mountain
+from .crud_util import Session
+from .notify_util import pg_listener
+from .logger_util import logger
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def to_record(mountain: Mountain) -> MountainRecord:
+    return MountainRecord(id=mountain.id,
+                          name=mountain.name,
+                          level=mountain.level,
+                          province=mountain.province,
+                          city=mountain.city,
+                          address=mountain.address,
+                          latitude=mountain.latitude,
+                          longitude=mountain.longitude)
+
+
+class MountainCatalog:
+    """
+    every t_mountain row in memory (the catalog is tens of thousands of rows at most) plus the indexes derived
+    from it. an index only needs a rebuild(records) method; rebuilds run in a thread and each index swaps its
+    new arrays in at once, so queries never see a half built index.
+
+    the whole table is read when the NOTIFY listener (re)connects (or on first use). after that only the ids
+    sent on MOUNTAIN_CHANGED_CHANNEL are re-read, batched over DEBOUNCE_SECONDS.
+    """
+    DEBOUNCE_SECONDS = 0.5
+
+    def __init__(self):
+        self.records: dict[int, MountainRecord] = {}
+        self.indexes: list = []
+        self.loaded = False
+        self.rebuilds = 0
+        self._changed: set[int] = set()
+        self._refresh_task: asyncio.Task | None = None
+        self._load_lock = asyncio.Lock()
+
+    def register(self, index):
+        self.indexes.append(index)
+        return index
+
+    async def ensure_loaded(self) -> None:
+        if not self.loaded:
+            async with self._load_lock:
+                if not self.loaded:
+                    await self._reload()
+
+    async def reload(self) -> None:
+        async with self._load_lock:
+            await self._reload()
+
+    async def _reload(self) -> None:
+        # ids notified meanwhile stay in _changed and are re-read once the lock is released
+        async with Session() as db:
+            mountains = await db.get_mountains()
+        self.records = {mountain.id: to_record(mountain) for mountain in mountains}
+        await self._rebuild()
+        self.loaded = True
+        logger.info({"mountains": len(self.records)}, extra="mountain_catalog_reload")
+
+    def on_notify(self, payload: str) -> None:
+        self._changed.add(int(payload))
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_changed())
+
+    async def _refresh_changed(self) -> None:
+        try:
+            while self._changed:
+                await asyncio.sleep(self.DEBOUNCE_SECONDS)
+                async with self._load_lock:
+                    ids, self._changed = list(self._changed), set()
+                    if not self.loaded:
+                        # the first load reads them anyway
+                        continue
+                    # re-read where the change was committed: a replica behind it would drop the mountain
+                    async with Session(use_primary=True) as db:
+                        mountains = {mountain.id: mountain for mountain in await db.get_mountains(ids)}
+
+                    records = dict(self.records)
+                    for mountain_id in ids:
+                        if mountain_id in mountains:
+                            records[mountain_id] = to_record(mountains[mountain_id])
+                        else:
+                            records.pop(mountain_id, None)
+                    self.records = records
+                    await self._rebuild()
+        finally:
+            self._refresh_task = None
+
+    async def _rebuild(self) -> None:
+        records = list(self.records.values())
+        for index in self.indexes:
+            await asyncio.to_thread(index.rebuild, records)
+        self.rebuilds += 1
+
+    def stats(self) -> dict:
+        return {"loaded": self.loaded,
+                "mountains": len(self.records),
+                "rebuilds": self.rebuilds,
+                "pending_changes": len(self._changed)}
+
+
+class MountainSpatialIndex:
+    """
+    mountains with coordinates as columnar numpy arrays sorted by latitude: unit vectors on the sphere for the
+    distance math and the latitudes for a binary searched band, so a radius query only touches the rows
+    that can be in range. k nearest widens such a band until it holds k mountains.
+    """
+    KNN_START_RADIUS_KM = 25
+
+    def __init__(self):
+        self._data = self._build([])
+
+    @staticmethod
+    def _build(records: list[MountainRecord]) -> tuple[np.ndarray, np.ndarray, list[MountainRecord]]:
+        located = sorted((r for r in records if r.latitude is not None and r.longitude is not None),
+                         key=lambda r: r.latitude)
+        latitudes = np.fromiter((r.latitude for r in located), dtype=np.float64, count=len(located))
+        longitudes = np.radians(np.fromiter((r.longitude for r in located), dtype=np.float64, count=len(located)))
+        lat_rad = np.radians(latitudes)
+        unit_vectors = np.column_stack((np.cos(lat_rad) * np.cos(longitudes),
+                                        np.cos(lat_rad) * np.sin(longitudes),
+                                        np.sin(lat_rad)))
+        return latitudes, unit_vectors, located
+
+    def rebuild(self, records: list[MountainRecord]) -> None:
+        self._data = self._build(records)
+
+    def __len__(self) -> int:
+        return len(self._data[2])
+
+    @staticmethod
+    def _unit_vector(latitude: float, longitude: float) -> np.ndarray:
+        lat, lon = math.radians(latitude), math.radians(longitude)
+        return np.array((math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat)))
+
+    @staticmethod
+    def _results(records: list[MountainRecord], rows: np.ndarray, cosines: np.ndarray,
+                 offset: int = 0) -> list[tuple[MountainRecord, float]]:
+        distances = EARTH_RADIUS_KM * np.arccos(np.clip(cosines, -1.0, 1.0))
+        return [(records[offset + row], distance) for row, distance in zip(rows.tolist(), distances.tolist())]
+
+    def nearest(self, latitude: float, longitude: float, k: int) -> list[tuple[MountainRecord, float]]:
+        """
+        Returns: [(mountain, distance_km)] of the k nearest mountains, nearest first
+        """
+        # k hits within a radius are the k nearest overall, so widen a latitude band before scanning everything
+        radius_km = self.KNN_START_RADIUS_KM
+        while radius_km < math.pi * EARTH_RADIUS_KM:
+            found = self.within(latitude, longitude, radius_km, k)
+            if len(found) >= k:
+                return found
+            radius_km *= 4
+        return self._nearest_scan(latitude, longitude, k)
+
+    def _nearest_scan(self, latitude: float, longitude: float, k: int) -> list[tuple[MountainRecord, float]]:
+        _, unit_vectors, records = self._data
+        if not records or k <= 0:
+            return []
+
+        cosines = unit_vectors @ self._unit_vector(latitude, longitude)
+        if k < len(records):
+            rows = np.argpartition(-cosines, k - 1)[:k]
+        else:
+            rows = np.arange(len(records))
+        rows = rows[np.argsort(-cosines[rows], kind="stable")]
+        return self._results(records, rows, cosines[rows])
+
+    def within(self, latitude: float, longitude: float, radius_km: float,
+               limit: int | None = None) -> list[tuple[MountainRecord, float]]:
+        """
+        Returns: [(mountain, distance_km)] within radius_km, nearest first, at most limit of them
+        """
+        latitudes, unit_vectors, records = self._data
+        angle = radius_km / EARTH_RADIUS_KM
+        if not records or angle <= 0:
+            return []
+
+        # nothing further than the radius in latitude alone can be in range
+        band = math.degrees(angle)
+        lo = int(np.searchsorted(latitudes, latitude - band, side="left"))
+        hi = int(np.searchsorted(latitudes, latitude + band, side="right"))
+        cosines = unit_vectors[lo:hi] @ self._unit_vector(latitude, longitude)
+
+        rows = np.flatnonzero(cosines >= math.cos(min(angle, math.pi)))
+        if limit is not None and limit < len(rows):
+            rows = rows[np.argpartition(-cosines[rows], limit - 1)[:limit]]
+        rows = rows[np.argsort(-cosines[rows], kind="stable")]
+        return self._results(records, rows, cosines[rows], offset=lo)
+
+
+KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(ord("ァ"), ord("ヶ") + 1)}
+
+
+def normalize_search_text(text: str | None) -> str:
+    # width, case and kana folded: "ﾌｼﾞ", "フジ" and "ふじ" match each other, as do "Fuji" and "ＦＵＪＩ"
+    return unicodedata.normalize("NFKC", text or "").casefold().translate(KATAKANA_TO_HIRAGANA).replace(" ", "")
+
+
+def ngrams(text: str, n: int) -> set[str]:
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class MountainSearchIndex:
+    """
+    search-as-you-type over mountain names (and province / city prefixes), CJK or not.
+
+    names are indexed by character bigrams (unigrams for one character queries) with numpy posting arrays:
+    the gram overlap of every name is one bincount, which also tolerates typos and partial input.
+    matches are ranked by quality (exact name > name prefix > province / city prefix > gram similarity),
+    then by level, then by the shorter name.
+    """
+    EXACT_SCORE = 3.0
+    NAME_PREFIX_SCORE = 2.0
+    PLACE_PREFIX_SCORE = 1.0
+    # share of the query grams a name must contain to be a fuzzy match
+    MIN_GRAM_OVERLAP = 0.5
+
+    def __init__(self):
+        self._data = self._build([])
+
+    @staticmethod
+    def _build(records: list[MountainRecord]) -> dict:
+        names = [normalize_search_text(r.name) for r in records]
+        postings: dict[int, dict[str, list[int]]] = {1: {}, 2: {}}
+        for row, name in enumerate(names):
+            for n, grams in postings.items():
+                for gram in ngrams(name, n):
+                    grams.setdefault(gram, []).append(row)
+
+        prefix_entries = sorted((key, row, score)
+                                for row, r in enumerate(records)
+                                for key, score in ((names[row], MountainSearchIndex.NAME_PREFIX_SCORE),
+                                                   (normalize_search_text(r.province), MountainSearchIndex.PLACE_PREFIX_SCORE),
+                                                   (normalize_search_text(r.city), MountainSearchIndex.PLACE_PREFIX_SCORE))
+                                if key)
+        exact: dict[str, list[int]] = {}
+        for row, name in enumerate(names):
+            exact.setdefault(name, []).append(row)
+
+        return {
+            "records": records,
+            "postings": {n: {gram: np.array(rows, dtype=np.int32) for gram, rows in grams.items()}
+                         for n, grams in postings.items()},
+            "gram_counts": {n: np.array([max(len(name) - n + 1, 0) for name in names], dtype=np.float32)
+                            for n in postings},
+            "name_lengths": np.array([len(name) for name in names], dtype=np.int32),
+            "levels": np.array([r.level or 0 for r in records], dtype=np.int32),
+            "prefix_keys": [key for key, _, _ in prefix_entries],
+            "prefix_rows": np.array([row for _, row, _ in prefix_entries], dtype=np.int32),
+            "prefix_scores": np.array([score for _, _, score in prefix_entries], dtype=np.float32),
+            "prefix_lengths": np.array([len(key) for key, _, _ in prefix_entries], dtype=np.float32),
+            "exact": exact,
+        }
+
+    def rebuild(self, records: list[MountainRecord]) -> None:
+        self._data = self._build(records)
+
+    def search(self, query: str, limit: int = 10) -> list[tuple[MountainRecord, float]]:
+        """
+        Returns: [(mountain, match score)] best first
+        """
+        data = self._data
+        query = normalize_search_text(query)
+        records = data["records"]
+        if not query or not records or limit <= 0:
+            return []
+
+        # fuzzy: share of query grams found in the name, as a dice coefficient below 1
+        n = 1 if len(query) == 1 else 2
+        grams = ngrams(query, n)
+        hits = [data["postings"][n][gram] for gram in grams if gram in data["postings"][n]]
+        if hits:
+            overlap = np.bincount(np.concatenate(hits), minlength=len(records)).astype(np.float32)
+            scores = 2 * overlap / (len(grams) + data["gram_counts"][n])
+            scores[overlap < math.ceil(len(grams) * self.MIN_GRAM_OVERLAP)] = 0
+        else:
+            scores = np.zeros(len(records), dtype=np.float32)
+
+        # every key starting with the query sorts between query and query + the highest code point
+        start = bisect.bisect_left(data["prefix_keys"], query)
+        end = bisect.bisect_left(data["prefix_keys"], query + "\U0010ffff", lo=start)
+        if start < end:
+            # longer keys are a weaker match for the same prefix
+            prefix_scores = data["prefix_scores"][start:end] + len(query) / data["prefix_lengths"][start:end] * 0.5
+            np.maximum.at(scores, data["prefix_rows"][start:end], prefix_scores)
+        for row in data["exact"].get(query, ()):
+            scores[row] = self.EXACT_SCORE
+
+        candidates = np.flatnonzero(scores > 0)
+        # one sortable int: match score (to 1/1000), then level, then the shorter name
+        ranks = (np.rint(scores[candidates] * 1000).astype(np.int64) * 1_000_000
+                 + np.clip(data["levels"][candidates], 0, 999) * 1000
+                 + 999 - np.clip(data["name_lengths"][candidates], 0, 999))
+        if len(candidates) > limit:
+            top = np.argpartition(-ranks, limit - 1)[:limit]
+            candidates, ranks = candidates[top], ranks[top]
+        rows = candidates[np.argsort(-ranks, kind="stable")]
+        return [(records[row], score) for row, score in zip(rows.tolist(), scores[rows].tolist())]
+
+
+# use these instances directly as singletons
+mountain_catalog = MountainCatalog()
+mountain_spatial_index = mountain_catalog.register(MountainSpatialIndex())
+mountain_search_index = mountain_catalog.register(MountainSearchIndex())
+pg_listener.subscribe(MOUNTAIN_CHANGED_CHANNEL,
+                      on_notify=mountain_catalog.on_notify,
+                      on_connect=mountain_catalog.reload)
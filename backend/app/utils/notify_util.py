@@ -0,0 +1,89 @@
+import asyncio
+import inspect
+from typing import Callable
+import asyncpg
+from sqlalchemy.engine import make_url
+
+from config import settings
+from .logger_util import logger
+
+
+class PgNotifyListener:
+    """
+    one dedicated asyncpg connection per worker that LISTENs on every subscribed channel.
+
+    usage:
+        pg_listener.subscribe("channel", on_notify=func(payload), on_connect=func(), on_disconnect=func())
+        on_connect / on_disconnect may be coroutine functions. on_connect runs after LISTEN is active (and again
+        after every reconnect), so it is the place to reload whatever may have missed a notification.
+    """
+    RECONNECT_INTERVAL_SECONDS = 5
+
+    def __init__(self):
+        self.listening = False
+        self._subscriptions: dict[str, tuple[Callable, Callable | None, Callable | None]] = {}
+        self._listener_task: asyncio.Task | None = None
+
+    def subscribe(self, channel: str, on_notify: Callable, on_connect: Callable | None = None,
+                  on_disconnect: Callable | None = None) -> None:
+        self._subscriptions[channel] = (on_notify, on_connect, on_disconnect)
+
+    def start(self) -> None:
+        if self._listener_task is None:
+            self._listener_task = asyncio.create_task(self._listen_forever())
+
+    async def stop(self) -> None:
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+
+    @staticmethod
+    async def _call(func: Callable | None, *args) -> None:
+        if func is None:
+            return
+        try:
+            result = func(*args)
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            logger.error({"callback": getattr(func, "__qualname__", str(func)), "error_detail": str(e)},
+                         extra="pg_listener")
+
+    async def _listen_forever(self) -> None:
+        dsn = make_url(settings.DB_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+        while True:
+            try:
+                conn = await asyncpg.connect(dsn)
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning({"status": "connect_failed", "error_detail": str(e)}, extra="pg_listener")
+                await asyncio.sleep(self.RECONNECT_INTERVAL_SECONDS)
+                continue
+
+            closed = asyncio.Event()
+            conn.add_termination_listener(lambda _conn: closed.set())
+            try:
+                for channel, (on_notify, _, _) in self._subscriptions.items():
+                    await conn.add_listener(channel, lambda _c, _pid, _ch, payload, f=on_notify: f(payload))
+                self.listening = True
+                for _, on_connect, _ in self._subscriptions.values():
+                    await self._call(on_connect)
+                logger.info({"status": "listening", "channels": list(self._subscriptions)}, extra="pg_listener")
+                await closed.wait()
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning({"status": "disconnected", "error_detail": str(e)}, extra="pg_listener")
+            finally:
+                self.listening = False
+                for _, _, on_disconnect in self._subscriptions.values():
+                    await self._call(on_disconnect)
+                if not conn.is_closed():
+                    await conn.close()
+
+            await asyncio.sleep(self.RECONNECT_INTERVAL_SECONDS)
+
+
+# use this instance directly as singleton
+pg_listener = PgNotifyListener()
@@ -0,0 +1,191 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+from config import settings
+from exceptions import QuotaExceededError
+from .crud_util import Session, session_advisory_lock
+from .logger_util import logger
+
+
+# any constant works, it only has to be the same for every worker
+QUOTA_RESET_LOCK_ID = 7_262_018
+
+
+class QuotaBucket:
+    __slots__ = ("tokens", "last_reset", "touched_at", "reserving")
+
+    def __init__(self):
+        self.tokens = 0
+        self.last_reset: datetime | None = None
+        self.touched_at = time.monotonic()
+        # reserve_quota calls in flight, flush() leaves the bucket alone until they have added their units
+        self.reserving = 0
+
+
+class QuotaService:
+    """
+    quota accounting on t_quota without read-modify-write.
+
+    consume() is a single UPDATE ... SET used_quota = used_quota + n WHERE used_quota + n <= total_quota
+    RETURNING, so concurrent messages of one user only hold the row lock for that statement.
+
+    with bucket_size > 1 a worker reserves bucket_size units of a user at once and serves the next messages
+    from memory. unused units go back in one batched UPDATE once a bucket has been idle for flush_seconds
+    (and at shutdown), so a user can have up to bucket_size units per worker reserved but not used yet.
+
+    a user without a row gets one with default_quota on the first request the quota guards.
+
+    the reset sweep sets used_quota = 0 on rows whose last_reset is older than reset_hours, chunk_size rows
+    per transaction, so the table is never locked as a whole. one worker sweeps at a time: the whole sweep
+    runs under a session level advisory lock.
+    """
+    def __init__(self, bucket_size: int, flush_seconds: int, reset_hours: int, chunk_size: int, sweep_seconds: int,
+                 default_quota: int):
+        self.bucket_size = bucket_size
+        self.default_quota = default_quota
+        self.flush_seconds = flush_seconds
+        self.reset_period = timedelta(hours=reset_hours)
+        self.chunk_size = chunk_size
+        self.sweep_seconds = sweep_seconds
+        self.buckets: dict[str, QuotaBucket] = {}
+        self.db_updates = 0
+        self.bucket_hits = 0
+        self.reset_rows = 0
+        self._task: asyncio.Task | None = None
+
+    async def consume(self, user_id: str, amount: int = 1) -> None:
+        """
+        raises QuotaExceededError(429) when the user has not enough quota left
+        """
+        if self.bucket_size <= 1:
+            remaining = await self._consume(user_id, amount)
+            if remaining is None and await self._create_quota(user_id):
+                remaining = await self._consume(user_id, amount)
+            if remaining is None:
+                raise QuotaExceededError
+            return
+
+        bucket = self.buckets.setdefault(user_id, QuotaBucket())
+        bucket.touched_at = time.monotonic()
+        if bucket.tokens < amount:
+            bucket.reserving += 1
+            try:
+                wanted = max(amount, self.bucket_size) - bucket.tokens
+                granted, last_reset = await self._reserve(user_id, wanted)
+                # (0, None) also means there is no row yet
+                if not granted and last_reset is None and await self._create_quota(user_id):
+                    granted, last_reset = await self._reserve(user_id, wanted)
+            finally:
+                bucket.reserving -= 1
+            if granted:
+                bucket.tokens += granted
+                bucket.last_reset = last_reset
+            if bucket.tokens < amount:
+                # what was granted stays reserved for smaller requests, the flush hands it back when unused
+                raise QuotaExceededError
+        else:
+            self.bucket_hits += 1
+
+        bucket.tokens -= amount
+
+    async def _consume(self, user_id: str, amount: int) -> int | None:
+        self.db_updates += 1
+        async with Session(use_primary=True) as db:
+            return await db.consume_quota(user_id, amount)
+
+    async def _reserve(self, user_id: str, amount: int) -> tuple[int, datetime | None]:
+        self.db_updates += 1
+        async with Session(use_primary=True) as db:
+            return await db.reserve_quota(user_id, amount)
+
+    async def _create_quota(self, user_id: str) -> bool:
+        async with Session(use_primary=True) as db:
+            return await db.create_quota(user_id, self.default_quota)
+
+    async def flush(self, idle_seconds: float | None = None) -> None:
+        """
+        hand back the unused units of buckets idle for idle_seconds (all buckets when None)
+        """
+        now = time.monotonic()
+        idle = [user_id for user_id, bucket in self.buckets.items()
+                if not bucket.reserving and (idle_seconds is None or now - bucket.touched_at >= idle_seconds)]
+        releases = []
+        for user_id in idle:
+            bucket = self.buckets.pop(user_id)
+            if bucket.tokens > 0:
+                releases.append((user_id, bucket.tokens, bucket.last_reset))
+        if not releases:
+            return
+
+        async with Session(use_primary=True) as db:
+            await db.release_quotas(releases)
+
+    async def reset_sweep(self) -> int:
+        """
+        Returns: number of rows reset (0 when another worker is sweeping)
+        """
+        reset_before = datetime.now(timezone.utc) - self.reset_period
+        after_id, count = 0, 0
+        # the lock sits on its own autocommit connection and every chunk commits in its own short transaction,
+        # so a long sweep never holds a transaction open
+        async with session_advisory_lock(QUOTA_RESET_LOCK_ID) as locked:
+            if not locked:
+                return 0
+            while True:
+                async with Session(use_primary=True) as db:
+                    ids = await db.reset_quotas_chunk(reset_before, after_id, self.chunk_size)
+                if not ids:
+                    break
+                count += len(ids)
+                after_id = max(ids)
+                # let requests in between two chunks
+                await asyncio.sleep(0)
+
+        if count:
+            logger.info({"reset_rows": count}, extra="quota_reset_sweep")
+        self.reset_rows += count
+        return count
+
+    async def _run_forever(self) -> None:
+        next_sweep = 0.0
+        while True:
+            try:
+                await self.flush(idle_seconds=self.flush_seconds)
+                if time.monotonic() >= next_sweep:
+                    next_sweep = time.monotonic() + self.sweep_seconds
+                    await self.reset_sweep()
+            except Exception as e:
+                logger.error({"error_detail": str(e)}, extra="quota_service")
+            await asyncio.sleep(self.flush_seconds)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {"bucket_size": self.bucket_size,
+                "buckets": len(self.buckets),
+                "reserved_units": sum(bucket.tokens for bucket in self.buckets.values()),
+                "db_updates": self.db_updates,
+                "bucket_hits": self.bucket_hits,
+                "reset_rows": self.reset_rows}
+
+
+# use this instance directly as singleton
+quota_service = QuotaService(bucket_size=settings.QUOTA_BUCKET_SIZE,
+                             flush_seconds=settings.QUOTA_FLUSH_SECONDS,
+                             reset_hours=settings.QUOTA_RESET_HOURS,
+                             chunk_size=settings.QUOTA_RESET_CHUNK_SIZE,
+                             sweep_seconds=settings.QUOTA_SWEEP_SECONDS,
+                             default_quota=settings.QUOTA_DEFAULT_TOTAL)
@@ -0,0 +1,46 @@
+from decimal import Decimal
+from typing import Any
+import orjson
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+
+# dataclasses (slots too), datetime / date / time, UUID, enums and numpy arrays are serialized by orjson itself.
+# datetimes keep their microseconds, like FastAPI's response_model output
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def orjson_default(obj: Any) -> Any:
+    """
+    only called for the types orjson can't serialize natively. whatever it returns is serialized by orjson
+    again, so a model costs one model_dump() instead of a jsonable_encoder walk over the whole payload
+    """
+    if isinstance(obj, BaseModel):
+        # json mode + aliases: the model's own serializers decide the output, as with a response_model
+        return obj.model_dump(mode="json", by_alias=True)
+    if isinstance(obj, Decimal):
+        return int(obj) if obj.as_tuple().exponent >= 0 else float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode()
+    # rare types (validation error contexts, form data, paths ...): same output as before
+    return jsonable_encoder(obj)
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=orjson_default, option=ORJSON_OPTIONS)
+
+
+# custom default response type
+class CustomORJSONResponse(Response):
+    """
+    single pass: the content goes to orjson as is, no jsonable_encoder copy of it first.
+    endpoints returning trusted dtos can return this response directly, which also skips FastAPI's
+    response_model validation / serialization (document the body with responses={200: {"model": ...}})
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
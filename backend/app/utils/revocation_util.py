@@ -0,0 +1,129 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+from uuid import uuid4
+
+from config import settings
+from database import REVOKED_TOKEN_ADDED_CHANNEL
+from exceptions import TokenInvalidError
+from .cache_util import BloomFilter
+from .crud_util import Session
+from .notify_util import pg_listener
+from .logger_util import logger
+
+
+REFRESH_TOKEN_FAMILY_EXP = timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
+
+
+class RefreshTokenRevocation:
+    """
+    revoked refresh token families, kept in a per-worker bloom filter in front of t_revoked_token.
+    a refresh token is single use through its family's generation in t_refresh_token_family, so rotating
+    rewrites one row per login instead of storing every used token.
+
+    the filter is (re)loaded from the table whenever the NOTIFY listener connects and updated by the
+    t_revoked_token insert trigger afterwards. a negative answer skips postgres entirely; the filter is only
+    trusted while the listener is connected.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.filter = BloomFilter(capacity)
+        self.ready = False
+        self.db_checks = 0
+        self.filter_negatives = 0
+        self._reloading = False
+        self._pending: list[str] = []
+
+    async def reload(self) -> None:
+        if self._reloading:
+            return
+
+        self._reloading = True
+        self._pending = []
+        try:
+            async with Session(use_primary=True) as db:
+                await db.delete_expired_revoked_tokens()
+                token_ids = await db.get_unexpired_revoked_token_ids()
+
+            new_filter = BloomFilter(max(self.capacity, len(token_ids) * 2))
+            # ids notified while the table was being read must not be lost
+            for token_id in {*token_ids, *self._pending}:
+                new_filter.add(token_id)
+            self.filter = new_filter
+            self.ready = pg_listener.listening
+            logger.info({"revoked_tokens": len(token_ids)}, extra="revocation_reload")
+        finally:
+            self._reloading = False
+            self._pending = []
+
+    def add(self, token_id: str) -> None:
+        if self._reloading:
+            self._pending.append(token_id)
+        # revoke() adds right away and its own NOTIFY comes back later, count every id once
+        if self.filter.might_contain(token_id):
+            return
+        self.filter.add(token_id)
+        if not self._reloading and self.filter.count > self.filter.capacity:
+            # false positive rate grows past capacity, rebuild from the (purged) table
+            asyncio.get_running_loop().create_task(self.reload())
+
+    def on_disconnect(self) -> None:
+        self.ready = False
+
+    async def get_revoked(self, *token_ids: str) -> list[str]:
+        if self.ready and not any(self.filter.might_contain(token_id) for token_id in token_ids):
+            self.filter_negatives += 1
+            return []
+
+        self.db_checks += 1
+        async with Session(use_primary=True) as db:
+            return await db.get_revoked_token_ids(list(token_ids))
+
+    async def revoke(self, token_id: str, expires_at: datetime) -> bool:
+        async with Session(use_primary=True) as db:
+            revoked = await db.revoke_token(token_id, expires_at)
+        # don't wait for our own NOTIFY to come back
+        self.add(token_id)
+        return revoked
+
+    async def revoke_family(self, family_id: str) -> None:
+        # a family can keep rotating for REFRESH_TOKEN_EXP after this point
+        await self.revoke(family_id, datetime.now(timezone.utc) + REFRESH_TOKEN_FAMILY_EXP)
+
+    async def rotate(self, refresh_token_payload: dict) -> tuple[str, int]:
+        """
+        consume a refresh token: its family moves on to the next generation, so it can only be used once.
+        presenting an already rotated generation means the token leaked, so the whole family is revoked.
+
+        Returns: (family id, generation) for the new refresh token
+        """
+        family_id = refresh_token_payload.get("fam")
+        if family_id is None:
+            # issued before families existed (no fam / gen): the valid token starts a new family
+            return uuid4().hex, 0
+
+        generation = refresh_token_payload.get("gen", 0)
+        if await self.get_revoked(family_id):
+            raise TokenInvalidError("refresh token revoked")
+
+        async with Session(use_primary=True) as db:
+            advanced = await db.advance_token_family(family_id, generation,
+                                                     datetime.now(timezone.utc) + REFRESH_TOKEN_FAMILY_EXP)
+        if not advanced:
+            # reused, or rotated concurrently by another request (possibly in another worker)
+            await self.revoke_family(family_id)
+            raise TokenInvalidError("refresh token revoked")
+
+        return family_id, generation + 1
+
+    def stats(self) -> dict:
+        return {"ready": self.ready,
+                "db_checks": self.db_checks,
+                "filter_negatives": self.filter_negatives,
+                **self.filter.stats()}
+
+
+refresh_token_revocation = RefreshTokenRevocation(capacity=settings.REVOKED_TOKEN_FILTER_CAPACITY)
+pg_listener.subscribe(REVOKED_TOKEN_ADDED_CHANNEL,
+                      on_notify=refresh_token_revocation.add,
+                      on_connect=refresh_token_revocation.reload,
+                      on_disconnect=refresh_token_revocation.on_disconnect)
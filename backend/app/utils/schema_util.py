@@ -0,0 +1,94 @@
+import asyncio
+import hashlib
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.schema import CreateTable, CreateIndex
+
+from database import Base, engine, NOTIFY_TRIGGER_DDL, SchemaVersion
+from .logger_util import logger
+
+
+# any constant works, it only has to be the same for every process that migrates this database
+SCHEMA_MIGRATION_LOCK_ID = 7_262_015
+
+
+def schema_version() -> str:
+    # changes whenever a table, column, index or trigger definition changes, so nobody has to bump it by hand
+    dialect = postgresql.dialect()
+    ddl = []
+    for table in Base.metadata.sorted_tables:
+        ddl.append(str(CreateTable(table).compile(dialect=dialect)))
+        ddl.extend(str(CreateIndex(index).compile(dialect=dialect))
+                   for index in sorted(table.indexes, key=lambda ix: ix.name or ""))
+    ddl.extend(NOTIFY_TRIGGER_DDL)
+    return hashlib.sha256("\n".join(ddl).encode("utf-8")).hexdigest()
+
+
+SCHEMA_VERSION = schema_version()
+
+
+async def get_applied_version(conn) -> str | None:
+    if not await conn.run_sync(lambda sync_conn: sync_conn.dialect.has_table(sync_conn, SchemaVersion.__tablename__)):
+        return None
+    return await conn.scalar(select(SchemaVersion.version).where(SchemaVersion.id == 1))
+
+
+async def migrate() -> bool:
+    """
+    create missing tables / indexes and (re)install the NOTIFY triggers, once per schema version.
+    runs under a transaction level advisory lock: concurrent callers wait for the first one and then find the
+    stamp already up to date. create_all never alters existing columns.
+
+    Returns: True when this call applied the schema
+    """
+    async with engine.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": SCHEMA_MIGRATION_LOCK_ID})
+        if await get_applied_version(conn) == SCHEMA_VERSION:
+            return False
+
+        await conn.run_sync(Base.metadata.create_all)
+        # create_all skips the indexes of tables that already exist
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                await conn.execute(CreateIndex(index, if_not_exists=True))
+        for ddl in NOTIFY_TRIGGER_DDL:
+            await conn.execute(text(ddl))
+
+        await conn.execute(insert(SchemaVersion)
+                           .values(id=1, version=SCHEMA_VERSION)
+                           .on_conflict_do_update(index_elements=[SchemaVersion.id],
+                                                  set_={"version": SCHEMA_VERSION, "applied_at": text("now()")}))
+    logger.info({"schema_version": SCHEMA_VERSION}, extra="schema_migrate")
+    return True
+
+
+async def check_schema_version(auto_migrate: bool) -> bool:
+    """
+    worker startup check: a single SELECT of the stamp. on a mismatch the schema is migrated when
+    auto_migrate is set (the advisory lock lets only one worker do it), otherwise the caller refuses to start.
+
+    Returns: True when the database matches this build
+    """
+    async with engine.connect() as conn:
+        applied = await get_applied_version(conn)
+    if applied == SCHEMA_VERSION:
+        return True
+
+    if auto_migrate:
+        await migrate()
+        return True
+
+    logger.error({"schema_version": SCHEMA_VERSION, "applied_version": applied,
+                  "hint": "run `python -m utils.schema_util` from the app folder"}, extra="schema_check")
+    return False
+
+
+if __name__ == '__main__':
+    # usage (from the app folder, once per deploy before the workers start): python -m utils.schema_util
+    async def main():
+        applied = await migrate()
+        print(f"schema {SCHEMA_VERSION} {'applied' if applied else 'already up to date'}")
+        await engine.dispose()
+
+    asyncio.run(main())
@@ -0,0 +1,220 @@
+import asyncio
+import numpy as np
+from datetime import datetime
+
+from config import settings
+from database import TOUR_CHANGED_CHANNEL
+from .crud_util import Session
+from .notify_util import pg_listener
+from .logger_util import logger
+
+
+# summed per group, in this order
+STAT_FIELDS = ("tours", "distance", "up_duration", "down_duration", "difficulty_sum")
+
+
+def month_key(tour_date: datetime | None) -> str | None:
+    if tour_date is None:
+        return None
+    local = tour_date.astimezone(settings.CONST.TIMEZONE)
+    return f"{local.year:04d}-{local.month:02d}"
+
+
+class TourFacts:
+    """the part of a t_tour row the statistics are made of, kept to undo its contribution on update / delete"""
+    __slots__ = ("user_id", "month", "mountain_id", "values")
+
+    def __init__(self, row: tuple):
+        _, self.user_id, tour_date, self.mountain_id, distance, up_duration, down_duration, difficulty = row
+        self.month = month_key(tour_date)
+        self.values = (1, distance or 0, up_duration or 0, down_duration or 0, difficulty or 0)
+
+
+class TourStats:
+    __slots__ = STAT_FIELDS
+
+    def __init__(self, values=(0, 0, 0, 0, 0)):
+        self.tours, self.distance, self.up_duration, self.down_duration, self.difficulty_sum = values
+
+    def add(self, values: tuple, sign: int = 1) -> None:
+        self.tours += sign * values[0]
+        self.distance += sign * values[1]
+        self.up_duration += sign * values[2]
+        self.down_duration += sign * values[3]
+        self.difficulty_sum += sign * values[4]
+
+    def to_dict(self) -> dict:
+        return {"tours": self.tours,
+                "distance": self.distance,
+                "up_duration": self.up_duration,
+                "down_duration": self.down_duration,
+                "avg_difficulty": round(self.difficulty_sum / self.tours, 2) if self.tours else None}
+
+
+class TourStatsAggregate:
+    """
+    per-user tour totals, per (user, month) and per (user, mountain), held by every worker.
+
+    a full rebuild streams t_tour once and groups it with numpy (np.unique + one bincount per column).
+    after that every insert / update / delete sent on TOUR_CHANGED_CHANNEL re-reads just that row and moves
+    its contribution from the old groups to the new ones. leaderboards are sorted once per changed group and
+    served from that list until the group changes again.
+    """
+    DEBOUNCE_SECONDS = 0.5
+    LEADERBOARD_SIZE = 100
+
+    def __init__(self):
+        self.tours: dict[int, TourFacts] = {}
+        self.user_totals: dict[str, TourStats] = {}
+        # bucket key -> {user_id: stats}: ("month", "2025-08") / ("mountain", 12)
+        self.buckets: dict[tuple, dict[str, TourStats]] = {}
+        self.loaded = False
+        self.incremental_updates = 0
+        self._leaderboards: dict[tuple, list[tuple[str, TourStats]]] = {}
+        self._changed: set[int] = set()
+        self._refresh_task: asyncio.Task | None = None
+        self._load_lock = asyncio.Lock()
+
+    async def ensure_loaded(self) -> None:
+        if not self.loaded:
+            async with self._load_lock:
+                if not self.loaded:
+                    await self._reload()
+
+    async def reload(self) -> None:
+        async with self._load_lock:
+            await self._reload()
+
+    async def _reload(self) -> None:
+        # ids notified meanwhile stay in _changed and are re-read once the lock is released.
+        # the stream is the session's first statement, so it gets a transactional connection (server side cursor)
+        async with Session() as db:
+            rows = [row async for row in db.stream_tour_facts()]
+        tours, user_totals, buckets = await asyncio.to_thread(self.aggregate, rows)
+        self.tours, self.user_totals, self.buckets = tours, user_totals, buckets
+        self._leaderboards = {}
+        self.loaded = True
+        logger.info({"tours": len(tours), "users": len(user_totals)}, extra="tour_stats_reload")
+
+    @staticmethod
+    def aggregate(rows: list[tuple]) -> tuple[dict, dict, dict]:
+        """
+        full recompute. Returns: (tour facts by id, totals by user, {bucket key: {user_id: stats}})
+        """
+        tours = {row[0]: TourFacts(row) for row in rows if row[1] is not None}
+        facts = list(tours.values())
+        if not facts:
+            return tours, {}, {}
+
+        values = np.array([f.values for f in facts], dtype=np.int64)
+        user_ids, user_codes = np.unique(np.array([f.user_id for f in facts], dtype=object), return_inverse=True)
+
+        def group(keys: list) -> dict[tuple, TourStats]:
+            # keys: per tour hashable group key or None; -> {(user_id, key): stats}
+            present = np.array([key is not None for key in keys], dtype=bool)
+            if not present.any():
+                return {}
+            key_values, key_codes = np.unique(np.array([key for key in keys if key is not None], dtype=object),
+                                              return_inverse=True)
+            combined = user_codes[present] * len(key_values) + key_codes
+            groups, inverse = np.unique(combined, return_inverse=True)
+            sums = np.column_stack([np.bincount(inverse, weights=values[present, column], minlength=len(groups))
+                                    for column in range(len(STAT_FIELDS))]).astype(np.int64)
+            return {(user_ids[g // len(key_values)], key_values[g % len(key_values)]): TourStats(tuple(s))
+                    for g, s in zip(groups.tolist(), sums.tolist())}
+
+        user_sums = np.column_stack([np.bincount(user_codes, weights=values[:, column], minlength=len(user_ids))
+                                     for column in range(len(STAT_FIELDS))]).astype(np.int64)
+        user_totals = {user_id: TourStats(tuple(s)) for user_id, s in zip(user_ids.tolist(), user_sums.tolist())}
+
+        buckets: dict[tuple, dict[str, TourStats]] = {}
+        for kind, keys in (("month", [f.month for f in facts]), ("mountain", [f.mountain_id for f in facts])):
+            for (user_id, key), stats in group(keys).items():
+                buckets.setdefault((kind, key), {})[user_id] = stats
+        return tours, user_totals, buckets
+
+    def _apply(self, facts: TourFacts, sign: int) -> None:
+        self.user_totals.setdefault(facts.user_id, TourStats()).add(facts.values, sign)
+        self._leaderboards.pop(("all", None), None)
+        for bucket_key in (("month", facts.month), ("mountain", facts.mountain_id)):
+            if bucket_key[1] is None:
+                continue
+            bucket = self.buckets.setdefault(bucket_key, {})
+            stats = bucket.setdefault(facts.user_id, TourStats())
+            stats.add(facts.values, sign)
+            if stats.tours <= 0:
+                del bucket[facts.user_id]
+            self._leaderboards.pop(bucket_key, None)
+        if self.user_totals[facts.user_id].tours <= 0:
+            del self.user_totals[facts.user_id]
+
+    def on_notify(self, payload: str) -> None:
+        self._changed.add(int(payload))
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_changed())
+
+    async def _refresh_changed(self) -> None:
+        try:
+            while self._changed:
+                await asyncio.sleep(self.DEBOUNCE_SECONDS)
+                async with self._load_lock:
+                    ids, self._changed = list(self._changed), set()
+                    if not self.loaded:
+                        # the first load reads them anyway
+                        continue
+                    # the NOTIFY came from a commit on the primary, a lagging replica would read the tour as deleted
+                    async with Session(use_primary=True) as db:
+                        rows = {row[0]: row for row in await db.get_tour_facts(ids)}
+
+                    for tour_id in ids:
+                        old = self.tours.pop(tour_id, None)
+                        if old is not None:
+                            self._apply(old, -1)
+                        row = rows.get(tour_id)
+                        if row is not None and row[1] is not None:
+                            self.tours[tour_id] = TourFacts(row)
+                            self._apply(self.tours[tour_id], 1)
+                    self.incremental_updates += len(ids)
+        finally:
+            self._refresh_task = None
+
+    def get_user_stats(self, user_id: str) -> dict:
+        totals = self.user_totals.get(user_id, TourStats())
+        months = {key: bucket[user_id].to_dict() for (kind, key), bucket in self.buckets.items()
+                  if kind == "month" and user_id in bucket}
+        return {"total": totals.to_dict(), "months": dict(sorted(months.items(), reverse=True))}
+
+    def leaderboard(self, month: str | None = None, mountain_id: int | None = None,
+                    limit: int = 10) -> list[tuple[str, TourStats]]:
+        """
+        top users by distance (then number of tours) for a month ("YYYY-MM"), a mountain or all time
+        """
+        if month is not None:
+            bucket_key = ("month", month)
+        elif mountain_id is not None:
+            bucket_key = ("mountain", mountain_id)
+        else:
+            bucket_key = ("all", None)
+
+        board = self._leaderboards.get(bucket_key)
+        if board is None:
+            bucket = self.user_totals if bucket_key[0] == "all" else self.buckets.get(bucket_key, {})
+            board = sorted(bucket.items(), key=lambda item: (item[1].distance, item[1].tours), reverse=True)
+            board = board[:self.LEADERBOARD_SIZE]
+            self._leaderboards[bucket_key] = board
+        return board[:limit]
+
+    def stats(self) -> dict:
+        return {"loaded": self.loaded,
+                "tours": len(self.tours),
+                "users": len(self.user_totals),
+                "buckets": len(self.buckets),
+                "cached_leaderboards": len(self._leaderboards),
+                "incremental_updates": self.incremental_updates}
+
+
+# use this instance directly as singleton
+tour_stats = TourStatsAggregate()
+pg_listener.subscribe(TOUR_CHANGED_CHANNEL,
+                      on_notify=tour_stats.on_notify,
+                      on_connect=tour_stats.reload)
@@ -0,0 +1,63 @@
+import time
+
+from config import settings
+from custom_types import UserPrincipal
+from database import USER_CHANGED_CHANNEL
+from .cache_util import TTLLRUCache
+from .crud_util import Session
+from .notify_util import pg_listener
+
+
+class UserPrincipalCache:
+    """
+    user_id -> UserPrincipal cache shared by the requests of one worker.
+
+    every worker LISTENs on USER_CHANGED_CHANNEL (fed by a trigger on t_user) and drops the entry when the row
+    is updated or deleted. while the listener is down the cache is bypassed, so a missed NOTIFY can't serve
+    stale authority levels.
+    """
+    def __init__(self, max_size: int, ttl_seconds: int):
+        self.cache = TTLLRUCache("user_principal", max_size=max_size)
+        self.ttl_seconds = ttl_seconds
+        self._generation = 0
+
+    async def get_user(self, user_id: str) -> UserPrincipal | None:
+        if pg_listener.listening:
+            principal = self.cache.get(user_id)
+            if principal is not None:
+                return principal
+
+        generation = self._generation
+        async with Session(use_primary=True) as db:
+            user = await db.get_user_by_user_id(user_id)
+        if user is None:
+            return None
+
+        principal = UserPrincipal(id=user.id,
+                                  username=user.username,
+                                  authority_level=user.authority_level,
+                                  created_at=user.created_at,
+                                  update_datetime=user.update_datetime)
+
+        # an invalidation that arrived while the row was loading means the row may already be stale
+        if pg_listener.listening and generation == self._generation:
+            self.cache.set(user_id, principal, time.time() + self.ttl_seconds)
+        return principal
+
+    def invalidate(self, user_id: str | None = None) -> None:
+        self._generation += 1
+        if user_id is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(user_id)
+
+    def stats(self) -> dict:
+        return {"listening": pg_listener.listening, **self.cache.stats()}
+
+
+user_principal_cache = UserPrincipalCache(max_size=settings.USER_CACHE_SIZE, ttl_seconds=settings.USER_CACHE_TTL_SECONDS)
+# entries cached while LISTEN was not active may have missed a notification
+pg_listener.subscribe(USER_CHANGED_CHANNEL,
+                      on_notify=user_principal_cache.invalidate,
+                      on_connect=user_principal_cache.invalidate,
+                      on_disconnect=user_principal_cache.invalidate)
@@ -4,6 +4,7 @@ import { Buffer } from 'buffer';
 
 const endpoints = {
   publickey: '/account/publickey',
+  handshakeKey: '/account/handshake_key',
   login: '/account/login',
   signup: '/account/signup'
 };
@@ -14,12 +15,53 @@ export const getPublicKey = async () => {
   return response.data;
 };
 
+// 获取 X25519 握手公钥
+export const getHandshakeKey = async () => {
+  const response = await axiosInstance.get(endpoints.handshakeKey);
+  return response.data;
+};
+
+const toBase64 = (buffer) => Buffer.from(new Uint8Array(buffer)).toString('base64');
+
+// X25519 密钥协商 + AES-GCM 加密，格式: x25519.<kid>.<客户端公钥>.<nonce>.<密文>
+const handshakeEncrypt = async (data) => {
+  const { kid, public_key: serverPublicKey } = await getHandshakeKey();
+  const encoder = new TextEncoder();
+  const serverKey = await crypto.subtle.importKey('raw', Buffer.from(serverPublicKey, 'base64'), { name: 'X25519' }, false, []);
+  const clientKey = await crypto.subtle.generateKey({ name: 'X25519' }, true, ['deriveBits']);
+  const sharedKey = await crypto.subtle.deriveBits({ name: 'X25519', public: serverKey }, clientKey.privateKey, 256);
+  const hkdfKey = await crypto.subtle.importKey('raw', sharedKey, 'HKDF', false, ['deriveKey']);
+  const aesKey = await crypto.subtle.deriveKey(
+    { name: 'HKDF', hash: 'SHA-256', salt: new Uint8Array(), info: encoder.encode('climbclub-login-handshake') },
+    hkdfKey,
+    { name: 'AES-GCM', length: 256 },
+    false,
+    ['encrypt']
+  );
+  const nonce = crypto.getRandomValues(new Uint8Array(12));
+  const ciphertext = await crypto.subtle.encrypt(
+    { name: 'AES-GCM', iv: nonce, additionalData: encoder.encode(String(kid)) },
+    aesKey,
+    encoder.encode(data)
+  );
+  const clientPublicKey = await crypto.subtle.exportKey('raw', clientKey.publicKey);
+  return ['x25519', kid, toBase64(clientPublicKey), toBase64(nonce), toBase64(ciphertext)].join('.');
+};
+
 // 用公钥加密密码
 export const encryptPassword = async (password) => {
-  const publicKey = await getPublicKey();
   const timestamp = Date.now();
   const data = password + ':' + timestamp;
 
+  // 浏览器不支持 X25519 时退回 RSA
+  try {
+    return await handshakeEncrypt(data);
+  } catch (e) {
+    console.warn('x25519 handshake unavailable, falling back to rsa', e);
+  }
+
+  const publicKey = await getPublicKey();
+
   // 使用 jsencrypt 进行加密
   const encryptor = new JSEncrypt();
   encryptor.setPublicKey(publicKey); // 设置公钥